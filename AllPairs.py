@@ -0,0 +1,191 @@
+# All-pairs travel cost matrices over a Map.
+#
+# The matrices are indexed by station id (matrix[origin_id, destination_id]) and stored as float32, with
+# inf for the stations that can not be reached. Small maps use a vectorized Floyd-Warshall; bigger ones run
+# one Dijkstra per origin in a process pool that reads the connections from shared memory.
+#
+# Usage:
+#     >>> all_pairs_matrix(map, type_preference=1, filename='Lyon_bigCity_time.npy')
+#     >>> matrix = load_matrix('Lyon_bigCity_time.npy')   # memory-mapped, nothing is read until it is used
+#     >>> matrix[9, 3]
+
+from SearchAlgorithm import *
+from multiprocessing import shared_memory
+import multiprocessing
+import numpy as np
+
+FLOYD_WARSHALL_LIMIT = 400
+
+# Connections shared with the worker processes, set by init_all_pairs_worker
+_all_pairs_shared = {}
+
+
+def floyd_warshall(size, sources, destinations, costs, next_hop=False):
+    """
+     Vectorized Floyd-Warshall: one NumPy pass over the whole matrix for every intermediate station.
+     Format of the parameter is:
+        Args:
+            size (int): Number of rows and columns (largest station id + 1)
+            sources, destinations, costs (arrays): Every connection of the map and its cost
+            next_hop (bool): Also compute the next station of every best route
+        Returns:
+            dist (array): size x size costs
+            hops (array): size x size next stations (-1 if there is no route), or None
+    """
+
+    dist = np.full((size, size), np.inf)
+    np.minimum.at(dist, (sources, destinations), costs)
+    np.fill_diagonal(dist, 0)
+    hops = None
+    if next_hop:
+        hops = np.where(np.isfinite(dist), np.arange(size)[None, :], -1)
+        np.fill_diagonal(hops, -1)
+
+    for k in range(size):
+        through = dist[:, k:k + 1] + dist[k:k + 1, :]
+        if hops is not None:
+            improved = through < dist
+            hops = np.where(improved, hops[:, k:k + 1], hops)
+        np.minimum(dist, through, out=dist)
+
+    return dist, hops
+
+
+def tree_rows(sources, indptr, indices, costs, next_hop=False):
+    """
+     One Dijkstra per origin. Returns the rows of the cost matrix (and of the next hop matrix) for sources.
+    """
+
+    dist_rows = np.empty((len(sources), len(indptr) - 1), dtype=np.float32)
+    hop_rows = np.empty((len(sources), len(indptr) - 1), dtype=np.int32) if next_hop else None
+
+    for row, origin in enumerate(sources):
+        dist, pred = dijkstra(indptr, indices, costs, [origin])
+        dist_rows[row] = dist
+        if next_hop:
+            hop_rows[row] = next_hops(origin, pred.tolist())
+    return dist_rows, hop_rows
+
+
+def next_hops(origin, pred):
+    # The first station after the origin in the route to every station, following the predecessors once
+    hops = [-1] * len(pred)
+    for station in range(len(pred)):
+        chain = []
+        while station != origin and pred[station] != -1 and hops[station] == -1:
+            chain.append(station)
+            station = pred[station]
+        if station == origin:
+            hop = chain[-1] if chain else -1
+        else:
+            hop = hops[station]
+        for visited in chain:
+            hops[visited] = hop
+    return hops
+
+
+def share_array(array):
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def init_all_pairs_worker(descriptions):
+    # Attach to the read-only connections created by the parent process
+    for key, (name, shape, dtype) in descriptions.items():
+        block = shared_memory.SharedMemory(name=name)
+        _all_pairs_shared[key] = (block, np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf))
+
+
+def worker_rows(task):
+    sources, next_hop = task
+    shared = _all_pairs_shared
+    return sources, tree_rows(sources, shared['indptr'][1], shared['indices'][1], shared['costs'][1], next_hop)
+
+
+def worker_rows_local(task, indptr, indices, costs):
+    sources, next_hop = task
+    return sources, tree_rows(sources, indptr, indices, costs, next_hop)
+
+
+def all_pairs_matrix(map, type_preference=1, filename=None, next_hop_filename=None, next_hop=False,
+                     processes=None, chunk_size=32):
+    """
+     Cost of the best route between every pair of stations.
+     Format of the parameter is:
+        Args:
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected (see calculate_cost)
+            filename (str): If given, the matrix is written to this .npy file and returned memory-mapped
+            next_hop_filename (str): If given, the next hop matrix is written to this .npy file
+            next_hop (bool): Also compute the next station of every best route (int32, -1 if there is no route)
+            processes (int): Worker processes for big maps (default: all the CPUs). 1 runs in this process.
+            chunk_size (int): Origins sent to a worker at a time
+        Returns:
+            matrix (array): float32 matrix, matrix[origin_id, destination_id]
+            hops (array): int32 next hop matrix, or None
+    """
+
+    next_hop = next_hop or next_hop_filename is not None
+    size = len(map.indptr) - 1
+    costs = np.asarray(edge_costs(map, type_preference), dtype=np.float64)
+
+    matrix = open_matrix(filename, (size, size), np.float32)
+    hops = open_matrix(next_hop_filename, (size, size), np.int32) if next_hop else None
+
+    if size <= FLOYD_WARSHALL_LIMIT:
+        sources = np.repeat(np.arange(size), np.diff(map.indptr))
+        dist, all_hops = floyd_warshall(size, sources, map.indices, costs, next_hop)
+        matrix[...] = dist
+        if next_hop:
+            hops[...] = all_hops
+    else:
+        origins = list(range(size))
+        chunks = [(origins[i:i + chunk_size], next_hop) for i in range(0, size, chunk_size)]
+        processes = processes or multiprocessing.cpu_count()
+        if processes == 1:
+            results = (worker_rows_local(chunk, map.indptr, map.indices, costs) for chunk in chunks)
+            write_rows(results, matrix, hops)
+        else:
+            blocks, descriptions = [], {}
+            for key, array in (('indptr', map.indptr), ('indices', map.indices), ('costs', costs)):
+                block, descriptions[key] = share_array(array)
+                blocks.append(block)
+            try:
+                with multiprocessing.Pool(processes, initializer=init_all_pairs_worker,
+                                          initargs=(descriptions,)) as pool:
+                    write_rows(pool.imap_unordered(worker_rows, chunks), matrix, hops)
+            finally:
+                for block in blocks:
+                    block.close()
+                    block.unlink()
+
+    for array in (matrix, hops):
+        if isinstance(array, np.memmap):
+            array.flush()
+    if filename is not None:
+        matrix = load_matrix(filename)
+    if next_hop_filename is not None:
+        hops = load_matrix(next_hop_filename)
+    return matrix, hops
+
+
+def write_rows(results, matrix, hops):
+    for sources, (dist_rows, hop_rows) in results:
+        matrix[sources[0]:sources[-1] + 1] = dist_rows
+        if hops is not None:
+            hops[sources[0]:sources[-1] + 1] = hop_rows
+
+
+def open_matrix(filename, shape, dtype):
+    if filename is None:
+        return np.empty(shape, dtype=dtype)
+    return np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=shape)
+
+
+def load_matrix(filename):
+    """
+     Opens a matrix written by all_pairs_matrix without reading it: rows are loaded from disk when used.
+    """
+
+    return np.load(filename, mmap_mode='r')
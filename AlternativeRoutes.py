@@ -0,0 +1,159 @@
+# Alternative routes: the k best loopless routes between two stations (Yen's algorithm).
+#
+# One shortest path tree towards the destination is computed over the reversed connections and reused by
+# every spur search: its costs are the exact remaining cost in the full map, so they are a consistent A*
+# heuristic once some connections are removed, and when the tree route of a spur station does not use any
+# removed connection or station it is already the best spur route and no search is needed at all.
+#
+# Usage:
+#     >>> routes = k_shortest_paths(9, 3, map, k=3, type_preference=1)
+#     >>> [(route.route, route.g, route.transfers) for route in routes]
+
+from SearchAlgorithm import *
+import heapq
+import math
+
+
+def distances_to(destination_id, map, type_preference=0, maxsize=64):
+    """
+     Cost of the best route from every station to destination_id and the next connection of that route,
+     kept in map.shortest_path_trees next to the trees of shortest_path_tree.
+     Format of the parameter is:
+        Args:
+            destination_id (int): Final station id
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected (see calculate_cost)
+            maxsize (int): Maximum number of trees kept in the map
+        Returns:
+            dist (list): dist[s] is the cost from s to destination_id (inf if it can not be reached)
+            next_edge (list): Position in map.indices of the first connection of that route (-1 if none)
+    """
+
+    key = ReverseTreeKey(destination_id, type_preference)
+    trees = map.shortest_path_trees
+    if key in trees:
+        trees.move_to_end(key)
+        return trees[key]
+
+    indptr, sources, edges = map.reverse_csr()
+    costs = np.asarray(edge_costs(map, type_preference))
+    dist, pred = dijkstra(indptr, sources, costs[edges], [destination_id])
+    forward_indptr, forward_indices, _ = map.csr_lists()
+    next_edge = [-1] * len(dist)
+    for station, following in enumerate(pred.tolist()):
+        if following != -1:
+            for edge in range(forward_indptr[station], forward_indptr[station + 1]):
+                if forward_indices[edge] == following:
+                    next_edge[station] = edge
+                    break
+
+    trees[key] = (dist.tolist(), next_edge)
+    if len(trees) > maxsize:
+        trees.popitem(last=False)
+    return trees[key]
+
+
+def tree_edges(station, destination_id, next_edge, indices, removed_edges, removed_stations):
+    # Connections of the tree route from station, or None if it uses something that was removed
+    edges = []
+    while station != destination_id:
+        edge = next_edge[station]
+        if edge in removed_edges:
+            return None
+        station = indices[edge]
+        if station in removed_stations:
+            return None
+        edges.append(edge)
+    return edges
+
+
+def spur_search(spur, destination_id, map, costs, heuristic, removed_edges, removed_stations):
+    """
+     A* from spur to destination_id without the removed connections and stations, with the costs of the full
+     map as heuristic. Returns the connections of the best route, or None if there is none.
+    """
+
+    indptr, indices, sources = map.csr_lists()
+    g = {spur: 0}
+    pred = {spur: -1}
+    heap = [(heuristic[spur], 0, spur)]
+
+    while heap:
+        _, d, station = heapq.heappop(heap)
+        if d > g[station]:
+            continue
+        if station == destination_id:
+            edges = []
+            while pred[station] != -1:
+                edges.append(pred[station])
+                station = sources[pred[station]]
+            edges.reverse()
+            return edges
+        for edge in range(indptr[station], indptr[station + 1]):
+            connected = indices[edge]
+            if edge in removed_edges or connected in removed_stations or math.isinf(heuristic[connected]):
+                continue
+            new_d = d + costs[edge]
+            if new_d < g.get(connected, math.inf):
+                g[connected] = new_d
+                pred[connected] = edge
+                heapq.heappush(heap, (new_d + heuristic[connected], new_d, connected))
+    return None
+
+
+def k_shortest_paths(origin_id, destination_id, map, k=3, type_preference=0):
+    """
+     The k best routes from origin_id to destination_id that do not visit a station twice (Yen's algorithm),
+     with the costs of calculate_cost.
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            destination_id (int): Final station id
+            map (object of Map class): All the map information
+            k (int): Number of routes
+            type_preference: INTEGER Value to indicate the preference selected (see calculate_cost)
+        Returns:
+            routes (list): Up to k CoolerPath, from the best one, each with its g and transfers
+    """
+
+    if k <= 0:
+        return []
+    dist, next_edge = distances_to(destination_id, map, type_preference)
+    if origin_id >= len(dist) or math.isinf(dist[origin_id]):
+        return []
+
+    indices = map.csr_lists()[1]
+    costs = edge_cost_list(map, type_preference)
+
+    best_edges = tree_edges(origin_id, destination_id, next_edge, indices, (), ())
+    routes = [path_from_edges(origin_id, best_edges, map, type_preference)]
+    found_edges = [best_edges]
+    candidates = []
+    seen = {tuple(routes[0].route)}
+
+    while len(routes) < k:
+        last_route, last_edges = routes[-1].route, found_edges[-1]
+        for i in range(len(last_edges)):
+            spur, root_edges = last_route[i], last_edges[:i]
+            # The next connection of every route found with the same root can not be taken again
+            removed_edges = {edges[i] for edges in found_edges if len(edges) > i and edges[:i] == root_edges}
+            removed_stations = set(last_route[:i])
+
+            spur_edges = tree_edges(spur, destination_id, next_edge, indices, removed_edges, removed_stations)
+            if spur_edges is None:
+                spur_edges = spur_search(spur, destination_id, map, costs, dist, removed_edges, removed_stations)
+            if spur_edges is None:
+                continue
+
+            path = path_from_edges(origin_id, root_edges + spur_edges, map, type_preference)
+            if tuple(path.route) not in seen:
+                seen.add(tuple(path.route))
+                heapq.heappush(candidates, (path.g, path.route, root_edges + spur_edges, path))
+
+        if not candidates:
+            break
+        _, _, edges, path = heapq.heappop(candidates)
+        routes.append(path)
+        found_edges.append(edges)
+
+    return routes
@@ -0,0 +1,135 @@
+# Batched routing: many independent Astar queries answered by a pool of worker processes.
+#
+# All the coordinates are snapped in one vectorized pass, the queries are grouped by destination so every
+# worker reuses the heuristic table of a destination, and every worker keeps its own copy of the Map.
+#
+# Usage:
+#     >>> routes = batch_astar([([108, 206], [67, 79]), ([140, 56], [140, 115])], map, type_preference=1,
+#     ...                      city_folder='CityInformation/Lyon_bigCity/')
+
+from SearchAlgorithm import *
+import os
+import multiprocessing
+
+# Map of the worker process, set once by init_worker
+_worker_map = None
+
+
+def init_worker(map, city_folder, changes=(), landmarks=None, start=0):
+    global _worker_map
+    # Loading the city in the worker is cheaper than pickling a big Map for every process. The changes and the
+    # landmarks of the map in the main process are not in the files, they are given to the worker.
+    _worker_map = read_city(city_folder) if city_folder is not None else map
+    apply_changes(_worker_map, changes, start)
+    for type_preference, (stations, dist_from, dist_to) in (landmarks or {}).items():
+        _worker_map.add_landmarks(type_preference, stations, dist_from, dist_to)
+
+
+def apply_changes(map, changes, start=0):
+    """
+     Makes the changes of another map's map.changes (update_connection, remove_connection, ...) that map does not
+     have yet, so a copy of a map read before they were made gets the same connections.
+     Format of the parameter is:
+        Args:
+            map (object of Map class): Copy of the map, with some of its first changes or none of them
+            changes (list): Changes of the map that was changed, from its change number start on
+            start (int): change_count() of that map when changes[0] was made (its changes_offset for map.changes)
+        Returns:
+            version (int): map.change_count() once the changes are made
+    """
+
+    made = map.change_count()
+    if made < start:
+        raise ValueError('The map misses changes {} to {}'.format(made, start - 1))
+    for method, args in changes[made - start:]:
+        getattr(map, method)(*args)
+    return map.change_count()
+
+
+def route_group(task, map=None):
+    """
+     Routes all the queries of one destination, with the map of the worker process by default.
+     Format of the parameter is:
+        Args:
+            task (tuple): (destination_ids, queries, type_preference, landmarks), queries is a list of
+                          (index, origin_ids)
+            map (object of Map class): All the map information
+        Returns:
+            routes (list): (index, route) for every query
+    """
+
+    if map is None:
+        map = _worker_map
+    destination_ids, queries, type_preference, landmarks = task
+    return [(index, astar_search(origin_ids, destination_ids, map, type_preference, landmarks))
+            for index, origin_ids in queries]
+
+
+def route_group_changed(task, changes, start=0, map=None):
+    """
+     route_group on the map with the changes of changes (see apply_changes), made first if the worker does not have
+     them yet. Returns (process id, version, routes), where version is the change_count() of the map used, so the
+     caller knows which changes every worker has.
+    """
+
+    if map is None:
+        map = _worker_map
+    version = apply_changes(map, changes, start)
+    return os.getpid(), version, route_group(task, map)
+
+
+def group_by_destination(origins, destinations, type_preference, landmarks, group_size):
+    groups = {}
+    for index, (origin_ids, destination_ids) in enumerate(zip(origins, destinations)):
+        groups.setdefault(tuple(destination_ids), []).append((index, origin_ids))
+
+    tasks = []
+    for destination_ids, queries in groups.items():
+        # Big groups are split so one popular destination does not keep a single worker busy
+        for start in range(0, len(queries), group_size):
+            tasks.append((list(destination_ids), queries[start:start + group_size], type_preference, landmarks))
+    return tasks
+
+
+def batch_astar(pairs, map, type_preference=0, landmarks=False, processes=None, city_folder=None,
+                group_size=64):
+    """
+     Answers many Astar queries at once. The result is the same as
+        [Astar(origin_coor, dest_coor, map, type_preference) for origin_coor, dest_coor in pairs]
+     Format of the parameter is:
+        Args:
+            pairs (list): (origin_coor, dest_coor) pairs of coordinates
+            map (object of Map class): All the map information, used to snap the coordinates
+            type_preference: INTEGER Value to indicate the preference selected (see Astar)
+            landmarks (bool): Use the landmarks of preprocess_landmarks as well as the usual heuristics
+            processes (int): Worker processes (default: all the CPUs). 1 answers the queries in this process.
+            city_folder (str): Folder the workers read the Map from, then they make the changes of map.changes
+                               and use its landmarks. If None, the map is sent to every worker.
+            group_size (int): Maximum number of queries of the same destination in one task
+        Returns:
+            routes (list): Route of every pair, in the same order
+    """
+
+    if not pairs:
+        return []
+
+    snapped = coord2station_batch([coord for pair in pairs for coord in pair], map)
+    tasks = group_by_destination(snapped[0::2], snapped[1::2], type_preference, landmarks, group_size)
+    routes = [None] * len(pairs)
+
+    processes = processes or multiprocessing.cpu_count()
+    if processes == 1:
+        collect_routes((route_group(task, map) for task in tasks), routes)
+    else:
+        with multiprocessing.Pool(min(processes, len(tasks)), initializer=init_worker,
+                                  initargs=(map if city_folder is None else None, city_folder, list(map.changes),
+                                            map.landmarks if city_folder is not None else None,
+                                            map.changes_offset)) as pool:
+            collect_routes(pool.imap_unordered(route_group, tasks), routes)
+    return routes
+
+
+def collect_routes(results, routes):
+    for group in results:
+        for index, route in group:
+            routes[index] = route
@@ -0,0 +1,270 @@
+# Benchmarks of the search algorithms on synthetic metro networks of growing size.
+#
+# generate_network writes a city folder (Stations.txt, Time.txt and InfoVelocity.txt) in the same formats as
+# CityInformation, so the networks are read with read_city like the real ones. run_benchmark times
+# depth_first_search, breadth_first_search, uniform_cost_search and Astar on every size and type_preference,
+# and compare_results flags the timings that got slower, or the routes that changed, against a saved run.
+#
+# Usage:
+#     python Benchmark.py --output results.json
+#     python Benchmark.py --baseline results.json --tolerance 0.25     # exits with 1 if there are regressions
+#
+import os
+import sys
+import json
+import time
+import math
+import random
+import argparse
+import tempfile
+from SearchAlgorithm import *
+
+# (lines, stations per line) of every size
+SIZES = [(3, 8), (6, 16), (12, 32), (24, 64)]
+ALGORITHMS = ['depth_first_search', 'breadth_first_search', 'uniform_cost_search', 'Astar']
+
+
+def generate_network(folder, lines=4, stations_per_line=10, transfer_density=0.3, seed=0, size=1000,
+                     transfer_time=2):
+    """
+     Writes a synthetic metro network. Every line is a random walk across a size x size city; a station is a
+     transfer, with probability transfer_density, when it is placed on a station of an earlier line: both get
+     the same name and coordinates and are connected with transfer_time, like the transfers of the real data.
+     Format of the parameter is:
+        Args:
+            folder (str): Folder where Stations.txt, Time.txt and InfoVelocity.txt are written
+            lines (int): Number of lines
+            stations_per_line (int): Stations of every line
+            transfer_density (float): Probability of a station being a transfer to an earlier line
+            seed (int): Seed of the random generator
+            size (int): Width and height of the city
+            transfer_time (int): Time of a transfer between two lines in the same station
+        Returns:
+            stations (int): Number of stations written
+    """
+
+    rnd = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    stations = []
+    times = {}
+    step = size / (stations_per_line + 1)
+
+    for line in range(1, lines + 1):
+        x, y = rnd.uniform(0, size), rnd.uniform(0, size)
+        angle = rnd.uniform(0, 2 * math.pi)
+        previous = None
+        line_names = set()
+        for _ in range(stations_per_line):
+            id = len(stations) + 1
+            earlier = [s for s in stations if s[1] not in line_names]
+            if earlier and rnd.random() < transfer_density:
+                # The line goes through a station of another line, which becomes a transfer
+                _, name, _, x, y = rnd.choice(earlier)
+                for other in stations:
+                    if other[1] == name:
+                        times[(id, other[0])] = times[(other[0], id)] = transfer_time
+            else:
+                name = 'Station {}'.format(id)
+            stations.append((id, name, line, int(x), int(y)))
+            line_names.add(name)
+            if previous is not None:
+                times[(previous, id)] = times[(id, previous)] = rnd.randint(1, 9)
+            previous = id
+
+            # Walk to the next station, turning a little and staying inside the city
+            angle += rnd.uniform(-0.6, 0.6)
+            x = min(max(x + step * math.cos(angle), 0), size)
+            y = min(max(y + step * math.sin(angle), 0), size)
+
+    with open(os.path.join(folder, 'Stations.txt'), 'w') as fp:
+        for station in stations:
+            fp.write('{}\t{}\t{}\t{}\t{}\n'.format(*station))
+    with open(os.path.join(folder, 'Time.txt'), 'w') as fp:
+        for origin in range(1, len(stations) + 1):
+            fp.write(' '.join(str(times.get((origin, destination), 0))
+                              for destination in range(1, len(stations) + 1)) + '\n')
+    with open(os.path.join(folder, 'InfoVelocity.txt'), 'w') as fp:
+        for line in range(1, lines + 1):
+            fp.write('Line {} : {}\n'.format(line, rnd.randint(5, 20)))
+    return len(stations)
+
+
+def run_search(algorithm, map, origin, destination, type_preference, stats):
+    if algorithm == 'depth_first_search':
+        return depth_first_search(origin, destination, map, stats=stats)
+    elif algorithm == 'breadth_first_search':
+        return breadth_first_search(origin, destination, map, stats=stats)
+    elif algorithm == 'uniform_cost_search':
+        return uniform_cost_search(origin, destination, map, type_preference, stats=stats)
+    origin_coor = [map.stations[origin]['x'], map.stations[origin]['y']]
+    destination_coor = [map.stations[destination]['x'], map.stations[destination]['y']]
+    return Astar(origin_coor, destination_coor, map, type_preference, stats=stats)
+
+
+def time_queries(algorithm, map, pairs, type_preference, timeout, repeat=3):
+    """
+     Runs one algorithm over all the pairs, keeping the best time of repeat runs of every query (the counters
+     are taken from the first run). A query that takes longer than timeout seconds is stopped and the
+     remaining queries are not run.
+    """
+
+    times, costs = [], []
+    stats = SearchStats()
+    timed_out = False
+    for origin, destination in pairs:
+        best = math.inf
+        try:
+            for run in range(repeat):
+                start = time.perf_counter()
+                with test_timeout(timeout):
+                    route = run_search(algorithm, map, origin, destination, type_preference,
+                                       stats if run == 0 else None)
+                best = min(best, time.perf_counter() - start)
+        except TestTimeout:
+            timed_out = True
+            break
+        times.append(best)
+        costs.append(float(route.g) if isinstance(route, Path) else None)
+
+    times.sort()
+    return {'queries': len(times), 'timed_out': timed_out, 'found': sum(c is not None for c in costs),
+            'total_time': sum(times), 'mean_time': sum(times) / len(times) if times else None,
+            'p50_time': times[len(times) // 2] if times else None, 'max_time': times[-1] if times else None,
+            'expanded': stats.expanded, 'generated': stats.generated, 'peak_frontier': stats.peak_frontier,
+            'costs': costs}
+
+
+def run_benchmark(sizes=SIZES, queries=20, transfer_density=0.3, seed=0, timeout=10, algorithms=ALGORITHMS,
+                  folder=None, repeat=3, verbose=False):
+    """
+     Times every algorithm for every type_preference (depth and breadth first search have no costs, so they
+     run once) on networks of growing size. Once an algorithm times out it is skipped on the bigger networks.
+     Format of the parameter is:
+        Args:
+            sizes (list): (lines, stations per line) of every network
+            queries (int): Random station pairs timed on every network
+            transfer_density (float): See generate_network
+            seed (int): Seed of the networks and the queries
+            timeout (int): Seconds allowed for one query
+            algorithms (list): Names of the algorithms to time
+            folder (str): Where the networks are written (a temporary folder by default)
+            repeat (int): Runs of every query, the best time is kept
+            verbose (bool): Print a line for every timing as it finishes
+        Returns:
+            results (dict): Results of every network, ready to be written as JSON
+    """
+
+    results = {'queries': queries, 'transfer_density': transfer_density, 'seed': seed, 'timeout': timeout,
+               'networks': []}
+    skipped = set()
+
+    with tempfile.TemporaryDirectory() as temporary:
+        for lines, stations_per_line in sizes:
+            city = os.path.join(folder or temporary, 'synthetic_{}x{}'.format(lines, stations_per_line))
+            generate_network(city, lines, stations_per_line, transfer_density, seed)
+            map = read_city(city)
+            rnd = random.Random(seed)
+            ids = list(map.stations)
+            pairs = [(rnd.choice(ids), rnd.choice(ids)) for _ in range(queries)]
+
+            network = {'name': '{}x{}'.format(lines, stations_per_line), 'lines': lines,
+                       'stations_per_line': stations_per_line, 'stations': len(map.stations),
+                       'connections': len(map.indices), 'results': {}}
+            for algorithm in algorithms:
+                types = [None] if algorithm in ('depth_first_search', 'breadth_first_search') else [0, 1, 2, 3]
+                for type_preference in types:
+                    key = algorithm if type_preference is None else '{}[{}]'.format(algorithm, type_preference)
+                    if key in skipped:
+                        network['results'][key] = {'skipped': True}
+                        continue
+                    result = time_queries(algorithm, map, pairs, type_preference, timeout, repeat)
+                    network['results'][key] = result
+                    if result['timed_out']:
+                        skipped.add(key)
+                    if verbose:
+                        print("{:<8}{:<28}{:>8}{:>12}{:>12}".format(
+                            network['name'], key, result['queries'],
+                            '-' if result['mean_time'] is None else '{:.5f}'.format(result['mean_time']),
+                            'timeout' if result['timed_out'] else result['expanded']))
+            results['networks'].append(network)
+    return results
+
+
+def compare_results(results, baseline, tolerance=0.2, min_time=1e-3):
+    """
+     Differences between two runs of run_benchmark with the same settings.
+     Format of the parameter is:
+        Args:
+            results, baseline (dict): The new run and the saved one
+            tolerance (float): Relative increase of the mean time flagged as a regression
+            min_time (float): Mean times below this many seconds are too noisy to be compared
+        Returns:
+            regressions (list): One message per slower timing, changed route cost, more expanded paths or new
+                                timeout
+    """
+
+    regressions = []
+    saved = {network['name']: network['results'] for network in baseline['networks']}
+    for network in results['networks']:
+        for key, result in network['results'].items():
+            old = saved.get(network['name'], {}).get(key)
+            if old is None or old.get('skipped') or result.get('skipped'):
+                continue
+            name = '{} {}'.format(network['name'], key)
+            if result['timed_out'] and not old['timed_out']:
+                regressions.append('{}: timed out'.format(name))
+                continue
+            queries = min(result['queries'], old['queries'])
+            changed = [i for i in range(queries) if not same_cost(result['costs'][i], old['costs'][i])]
+            if changed:
+                regressions.append('{}: different cost in {} queries'.format(name, len(changed)))
+            if result['queries'] == old['queries'] and result['expanded'] > old['expanded']:
+                regressions.append('{}: {} expanded paths, baseline {}'.format(name, result['expanded'],
+                                                                               old['expanded']))
+            if old['mean_time'] and result['mean_time'] and max(old['mean_time'], result['mean_time']) >= min_time \
+                    and result['mean_time'] > old['mean_time'] * (1 + tolerance):
+                regressions.append('{}: mean time {:.5f} s, baseline {:.5f} s (+{:.0%})'.format(
+                    name, result['mean_time'], old['mean_time'], result['mean_time'] / old['mean_time'] - 1))
+    return regressions
+
+
+def same_cost(cost, old):
+    if cost is None or old is None:
+        return cost is old
+    return abs(cost - old) <= 1e-6 * max(1.0, abs(old))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the search algorithms on synthetic networks')
+    parser.add_argument('--sizes', default=','.join('{}x{}'.format(*s) for s in SIZES),
+                        help='lines x stations per line of every network, e.g. 3x8,6x16')
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--transfer-density', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=int, default=10, help='seconds allowed for one query')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every query, the best time is kept')
+    parser.add_argument('--algorithms', default=','.join(ALGORITHMS))
+    parser.add_argument('--folder', help='keep the generated networks in this folder')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare the results with this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(args)
+
+    sizes = [tuple(int(v) for v in size.split('x')) for size in args.sizes.split(',')]
+    results = run_benchmark(sizes, args.queries, args.transfer_density, args.seed, args.timeout,
+                            args.algorithms.split(','), args.folder, args.repeat, verbose=True)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressions = compare_results(results, json.load(fp), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+# Compares the number of expanded nodes of Astar with and without landmark (ALT) heuristics.
+#
+# Usage: python BenchmarkLandmarks.py [city_folder] [number_of_queries] [number_of_landmarks]
+#
+import sys
+import time
+import random
+from SearchAlgorithm import *
+from utils import *
+
+ROOT_FOLDER = 'CityInformation/Lyon_bigCity/'
+
+
+def run_query(origin, destination, map, type_preference, landmarks):
+    stats = SearchStats()
+    route = Astar(origin, destination, map, type_preference, landmarks, stats=stats)
+    return route, stats.expanded, stats.total_time
+
+
+def main(folder=ROOT_FOLDER, queries=100, k=8, seed=0):
+    map = read_city(folder)
+    rnd = random.Random(seed)
+    xs = [s["x"] for s in map.stations.values()]
+    ys = [s["y"] for s in map.stations.values()]
+    pairs = [([rnd.uniform(min(xs), max(xs)), rnd.uniform(min(ys), max(ys))],
+              [rnd.uniform(min(xs), max(xs)), rnd.uniform(min(ys), max(ys))]) for _ in range(queries)]
+
+    print("{:<12}{:>12}{:>14}{:>12}{:>14}{:>10}".format(
+        "preference", "expanded", "expanded ALT", "time (s)", "time ALT (s)", "prep (s)"))
+    for type_preference in (1, 2):
+        start = time.perf_counter()
+        preprocess_landmarks(map, type_preference, k)
+        preprocessing = time.perf_counter() - start
+
+        totals = [0, 0, 0.0, 0.0]
+        for origin, destination in pairs:
+            route, expanded, elapsed = run_query(origin, destination, map, type_preference, False)
+            alt_route, alt_expanded, alt_elapsed = run_query(origin, destination, map, type_preference, True)
+            found, alt_found = isinstance(route, Path), isinstance(alt_route, Path)
+            if found != alt_found or (found and abs(route.g - alt_route.g) > 1e-6):
+                raise AssertionError("ALT route is not optimal for {} -> {}".format(origin, destination))
+            totals = [totals[0] + expanded, totals[1] + alt_expanded, totals[2] + elapsed, totals[3] + alt_elapsed]
+
+        print("{:<12}{:>12}{:>14}{:>12.3f}{:>14.3f}{:>10.3f}".format(
+            type_preference, totals[0], totals[1], totals[2], totals[3], preprocessing))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(args[0] if len(args) > 0 else ROOT_FOLDER,
+         int(args[1]) if len(args) > 1 else 100,
+         int(args[2]) if len(args) > 2 else 8)
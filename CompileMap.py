@@ -0,0 +1,25 @@
+# Compiles a city folder (Stations.txt, Time.txt and InfoVelocity.txt) into one binary file that
+# read_city and read_compiled_map load without parsing any text.
+#
+# Usage: python CompileMap.py city_folder output_file
+#
+import sys
+import time
+from utils import *
+
+
+def main(folder, filename):
+    start = time.perf_counter()
+    map = read_city(folder)
+    parsed = time.perf_counter() - start
+    write_compiled_map(map, filename)
+
+    start = time.perf_counter()
+    read_compiled_map(filename)
+    loaded = time.perf_counter() - start
+    print("{} stations, {} connections: text {:.3f} s, compiled {:.3f} s".format(
+        len(map.stations), len(map.indices), parsed, loaded))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2])
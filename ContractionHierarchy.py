@@ -0,0 +1,280 @@
+# Contraction hierarchies for fast station-to-station queries over a static Map.
+#
+# The hierarchy is built once per type_preference with build_contraction_hierarchy, can be saved with
+# ContractionHierarchy.save and loaded by another process with ContractionHierarchy.load.
+#
+# Usage:
+#     >>> hierarchy = build_contraction_hierarchy(map, type_preference=1)
+#     >>> hierarchy.save('Lyon_bigCity_time.npz')
+#     >>> route = ContractionHierarchy.load('Lyon_bigCity_time.npz').query(9, 3)
+
+from SearchAlgorithm import *
+import heapq
+import math
+import numpy as np
+
+
+class ContractionHierarchy:
+    """
+    A contraction hierarchy: the rank of every station and all the edges of the map plus the shortcuts
+    added while contracting. Every edge (source, destination) keeps the station it skips (middle, -1 for
+    the connections of the map) so routes can be unpacked.
+
+    Queries are a bidirectional Dijkstra that only follows edges towards stations of higher rank:
+    forwards from the origin and backwards from the destination.
+    """
+
+    def __init__(self, type_preference, rank, sources, destinations, costs, middles, transfers):
+        self.type_preference = int(type_preference)
+        self.rank = np.asarray(rank, dtype=np.int64)
+        self.sources = np.asarray(sources, dtype=np.int64)
+        self.destinations = np.asarray(destinations, dtype=np.int64)
+        self.costs = np.asarray(costs, dtype=np.float64)
+        self.middles = np.asarray(middles, dtype=np.int64)
+        self.transfers = np.asarray(transfers, dtype=np.int64)
+
+        upward = self.rank[self.destinations] > self.rank[self.sources]
+        self.forward = self.upward_graph(self.sources[upward], self.destinations[upward], np.flatnonzero(upward))
+        downward = ~upward
+        self.backward = self.upward_graph(self.destinations[downward], self.sources[downward],
+                                          np.flatnonzero(downward))
+        self.edge_ids = {(s, d): e for e, (s, d) in enumerate(zip(self.sources.tolist(), self.destinations.tolist()))}
+        self.cost_list = self.costs.tolist()
+
+    def upward_graph(self, sources, destinations, edges):
+        # Adjacency lists of (station, edge), kept as Python lists because queries walk them one by one
+        graph = [[] for _ in range(len(self.rank))]
+        for source, destination, edge in zip(sources.tolist(), destinations.tolist(), edges.tolist()):
+            graph[source].append((destination, edge))
+        return graph
+
+    def save(self, filename):
+        np.savez(filename, type_preference=self.type_preference, rank=self.rank, sources=self.sources,
+                 destinations=self.destinations, costs=self.costs, middles=self.middles, transfers=self.transfers)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(data['type_preference'], data['rank'], data['sources'], data['destinations'],
+                       data['costs'], data['middles'], data['transfers'])
+
+    def query(self, origin_id, destination_id):
+        """
+        Best route from origin_id to destination_id.
+        Format of the parameter is:
+            Args:
+                origin_id (int): Starting station id
+                destination_id (int): Final station id
+            Returns:
+                path (CoolerPath): The route that goes from origin_id to destination_id, with its g and transfers
+                                   ([] if there is no route)
+        """
+        costs = self.cost_list
+        dist = ({origin_id: 0.0}, {destination_id: 0.0})
+        pred = ({origin_id: -1}, {destination_id: -1})
+        heaps = ([(0.0, origin_id)], [(0.0, destination_id)])
+        graphs = (self.forward, self.backward)
+        best, meeting = (0.0, origin_id) if origin_id == destination_id else (math.inf, None)
+
+        while heaps[0] or heaps[1]:
+            # Each direction stops once its smallest cost can not improve the best route found
+            side = 0 if heaps[0] and (not heaps[1] or heaps[0][0][0] <= heaps[1][0][0]) else 1
+            d, station = heapq.heappop(heaps[side])
+            if d >= best:
+                heaps[side].clear()
+                continue
+            if d > dist[side][station]:
+                continue
+            for connected, edge in graphs[side][station]:
+                new_d = d + costs[edge]
+                if new_d < dist[side].get(connected, math.inf):
+                    dist[side][connected] = new_d
+                    pred[side][connected] = edge
+                    heapq.heappush(heaps[side], (new_d, connected))
+                    other = dist[1 - side].get(connected)
+                    if other is not None and new_d + other < best:
+                        best, meeting = new_d + other, connected
+            other = dist[1 - side].get(station)
+            if other is not None and d + other < best:
+                best, meeting = d + other, station
+
+        if meeting is None:
+            return []
+
+        edges = []
+        station = meeting
+        while pred[0][station] != -1:
+            edge = pred[0][station]
+            edges.append(edge)
+            station = int(self.sources[edge])
+        edges.reverse()
+        station = meeting
+        while pred[1][station] != -1:
+            edge = pred[1][station]
+            edges.append(edge)
+            station = int(self.destinations[edge])
+        return self.to_path(origin_id, edges)
+
+    def unpack(self, edge):
+        # Original connections of the map hidden behind an edge, in route order
+        stack, unpacked = [edge], []
+        while stack:
+            edge = stack.pop()
+            middle = self.middles[edge]
+            if middle < 0:
+                unpacked.append(edge)
+            else:
+                source, destination = self.sources[edge], self.destinations[edge]
+                stack.append(self.edge_ids[(int(middle), int(destination))])
+                stack.append(self.edge_ids[(int(source), int(middle))])
+        return unpacked
+
+    def to_path(self, origin_id, edges):
+        # With connections of cost 0 (transfers for the minimum distance) the best route can go back to a
+        # station it already visited. Those loops cost 0 and are removed, like the other searches never take them.
+        route, originals = [origin_id], []
+        position = {origin_id: 0}
+        for edge in edges:
+            for original in self.unpack(edge):
+                station = int(self.destinations[original])
+                if station in position:
+                    for removed in route[position[station] + 1:]:
+                        del position[removed]
+                    del route[position[station] + 1:], originals[position[station]:]
+                else:
+                    position[station] = len(route)
+                    route.append(station)
+                    originals.append(original)
+
+        path = CoolerPath(origin_id)
+        for station, original in zip(route[1:], originals):
+            path.add_route(station)
+            # Costs are added one connection at a time, like calculate_cost does
+            path.update_g(self.costs[original])
+            path.update_transfers(int(self.transfers[original]))
+        path.update_f()
+        return path
+
+
+def contraction_hierarchy_search(origin_id, destination_id, hierarchy):
+    """
+     Station to station search over a contraction hierarchy.
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            destination_id (int): Final station id
+            hierarchy (ContractionHierarchy): Hierarchy built for the wanted type_preference
+        Returns:
+            list_of_path[0] (Path Class): The route that goes from origin_id to destination_id
+    """
+
+    return hierarchy.query(origin_id, destination_id)
+
+
+def build_contraction_hierarchy(map, type_preference=1, witness_limit=64):
+    """
+     Contracts the stations of the map one by one, from the least to the most important, adding a shortcut
+     u -> w whenever the only best route from u to w went through the contracted station.
+     The importance of a station is its edge difference (shortcuts added minus edges removed) plus the number
+     of neighbours already contracted, updated lazily.
+     Format of the parameter is:
+        Args:
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected:
+                            0 - Adjacency
+                            1 - minimum Time
+                            2 - minimum Distance
+            witness_limit (int): Maximum number of stations settled by each witness search. A smaller limit
+                                 builds faster but adds more (harmless) shortcuts.
+        Returns:
+            hierarchy (ContractionHierarchy)
+    """
+
+    size = len(map.indptr) - 1
+    edge_cost = edge_costs(map, type_preference).tolist()
+    transfer = edge_costs(map, 3).tolist()
+
+    # Remaining graph: outgoing[u][w] and incoming[w][u] are (cost, middle, transfers)
+    outgoing = [dict() for _ in range(size)]
+    incoming = [dict() for _ in range(size)]
+    for station in range(size):
+        for edge, connected in map.neighbours(station):
+            if connected != station:
+                outgoing[station][connected] = (edge_cost[edge], -1, transfer[edge])
+                incoming[connected][station] = outgoing[station][connected]
+    all_edges = {(u, w): value for u in range(size) for w, value in outgoing[u].items()}
+
+    contracted = [False] * size
+    contracted_neighbours = [0] * size
+    rank = np.zeros(size, dtype=np.int64)
+
+    def shortcuts(station):
+        # Shortcuts needed to contract station, found with one bounded witness search per incoming edge
+        needed = []
+        for source, (in_cost, _, in_transfers) in incoming[station].items():
+            targets = {target: in_cost + out_cost for target, (out_cost, _, _) in outgoing[station].items()
+                       if target != source}
+            if not targets:
+                continue
+            witness = witness_search(source, station, max(targets.values()))
+            for target, cost in targets.items():
+                if witness.get(target, math.inf) > cost:
+                    needed.append((source, target, cost, in_transfers + outgoing[station][target][2]))
+        return needed
+
+    def witness_search(source, excluded, max_cost):
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        settled = 0
+        while heap and settled < witness_limit:
+            d, station = heapq.heappop(heap)
+            if d > dist[station]:
+                continue
+            if d > max_cost:
+                break
+            settled += 1
+            for connected, (cost, _, _) in outgoing[station].items():
+                if connected != excluded and d + cost < dist.get(connected, math.inf):
+                    dist[connected] = d + cost
+                    heapq.heappush(heap, (d + cost, connected))
+        return dist
+
+    def priority(station):
+        return (len(shortcuts(station)) - len(incoming[station]) - len(outgoing[station])
+                + contracted_neighbours[station])
+
+    queue = [(priority(station), station) for station in range(size)]
+    heapq.heapify(queue)
+    order = 0
+
+    while queue:
+        _, station = heapq.heappop(queue)
+        if contracted[station]:
+            continue
+        # Lazy update: contract only if the station is still the least important one
+        current = priority(station)
+        if queue and current > queue[0][0]:
+            heapq.heappush(queue, (current, station))
+            continue
+
+        for source, target, cost, transfers in shortcuts(station):
+            if cost < outgoing[source].get(target, (math.inf,))[0]:
+                outgoing[source][target] = (cost, station, transfers)
+                incoming[target][source] = outgoing[source][target]
+                if cost < all_edges.get((source, target), (math.inf,))[0]:
+                    all_edges[(source, target)] = (cost, station, transfers)
+
+        for connected in set(incoming[station]) | set(outgoing[station]):
+            contracted_neighbours[connected] += 1
+            outgoing[connected].pop(station, None)
+            incoming[connected].pop(station, None)
+        outgoing[station], incoming[station] = {}, {}
+        contracted[station] = True
+        rank[station] = order
+        order += 1
+
+    pairs = list(all_edges)
+    values = [all_edges[pair] for pair in pairs]
+    return ContractionHierarchy(type_preference, rank,
+                                [u for u, _ in pairs], [w for _, w in pairs],
+                                [v[0] for v in values], [v[1] for v in values], [v[2] for v in values])
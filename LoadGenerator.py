@@ -0,0 +1,109 @@
+# Sends route queries to a running RoutingServer and reports the latency percentiles and the throughput.
+#
+# The queries are random points inside the bounding box of the city, drawn from a small pool so some of
+# them are repeated and can be coalesced by the server.
+#
+# Usage: python LoadGenerator.py [city_folder] [port] [requests] [concurrency] [distinct_queries]
+#
+import sys
+import json
+import time
+import random
+import asyncio
+from utils import *
+
+ROOT_FOLDER = 'CityInformation/Lyon_bigCity/'
+
+
+def random_queries(map, distinct, seed=0):
+    rnd = random.Random(seed)
+    xs = [s["x"] for s in map.stations.values()]
+    ys = [s["y"] for s in map.stations.values()]
+
+    def point():
+        return [round(rnd.uniform(min(xs), max(xs)), 2), round(rnd.uniform(min(ys), max(ys)), 2)]
+
+    return [{"origin": point(), "destination": point(), "type_preference": rnd.randrange(4)}
+            for _ in range(distinct)]
+
+
+def percentile(values, q):
+    # Nearest-rank percentile of sorted values
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))]
+
+
+async def post(reader, writer, host, query):
+    body = json.dumps(query).encode()
+    writer.write('POST /route HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'
+                 .format(host, len(body)).encode() + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def client(host, port, queries, counter, total, latencies, statuses):
+    # One keep-alive connection that sends its queries one after the other
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while counter[0] < total:
+            query = queries[counter[0] % len(queries)]
+            counter[0] += 1
+            start = time.perf_counter()
+            status = await post(reader, writer, host, query)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def run_load(queries, host='127.0.0.1', port=8080, total=1000, concurrency=32):
+    """
+     Sends total queries with concurrency clients at the same time.
+     Format of the parameter is:
+        Args:
+            queries (list): JSON bodies of /route, sent in a round robin
+            host, port: Address of the RoutingServer
+            total (int): Number of requests
+            concurrency (int): Number of connections sending requests at the same time
+        Returns:
+            report (dict): requests, statuses, p50 and p99 latency (s) and requests per second
+    """
+
+    counter, latencies, statuses = [0], [], {}
+    start = time.perf_counter()
+    await asyncio.gather(*[client(host, port, queries, counter, total, latencies, statuses)
+                           for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {'requests': len(latencies), 'statuses': statuses, 'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99), 'rps': len(latencies) / elapsed if elapsed > 0 else float('nan')}
+
+
+def main(folder=ROOT_FOLDER, port=8080, total=1000, concurrency=32, distinct=200):
+    queries = random_queries(read_city(folder), distinct)
+    report = asyncio.run(run_load(queries, '127.0.0.1', port, total, concurrency))
+    print("{:>10}{:>12}{:>12}{:>12}  {}".format("requests", "p50 (ms)", "p99 (ms)", "req/s", "statuses"))
+    print("{:>10}{:>12.2f}{:>12.2f}{:>12.1f}  {}".format(
+        report['requests'], report['p50'] * 1000, report['p99'] * 1000, report['rps'], report['statuses']))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(args[0] if len(args) > 0 else ROOT_FOLDER,
+         int(args[1]) if len(args) > 1 else 8080,
+         int(args[2]) if len(args) > 2 else 1000,
+         int(args[3]) if len(args) > 3 else 32,
+         int(args[4]) if len(args) > 4 else 200)
@@ -0,0 +1,104 @@
+# Multi-criteria routing: every route that is not worse than another one in time, transfers and distance.
+#
+# pareto_search is a label-setting search (multi-criteria Dijkstra): every station keeps the labels of the
+# routes that reach it and are not dominated by another one. Labels are stored by column (parent label,
+# connection and costs), so a route is only built for the labels of the destination.
+#
+# Usage:
+#     >>> front = pareto_search(9, 3, map)
+#     >>> [(route.route, route.g, route.transfers, route.distance) for route in front]
+
+from SearchAlgorithm import *
+import heapq
+
+# Criteria of pareto_search, as type_preferences of calculate_cost: time, transfers, distance
+PARETO_CRITERIA = (1, 3, 2)
+
+
+def dominates(costs, other):
+    # costs is at least as good as other in every criterion
+    for cost, other_cost in zip(costs, other):
+        if cost > other_cost:
+            return False
+    return True
+
+
+def pareto_search(origin_id, destination_id, map, criteria=PARETO_CRITERIA):
+    """
+     All the Pareto optimal routes from origin_id to destination_id in one search: no other route is at least
+     as good in every criterion and better in one. Routes with exactly the same costs are returned once.
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            destination_id (int): Final station id
+            map (object of Map class): All the map information
+            criteria (tuple): type_preferences compared (see calculate_cost), time, transfers and distance
+                              by default
+        Returns:
+            front (list): CoolerPath of every Pareto optimal route, by increasing costs. g is the cost of the
+                          first criterion, transfers the number of transfers and costs the cost of every
+                          criterion; with the default criteria, distance is the distance of the route.
+    """
+
+    indptr, indices, _ = map.csr_lists()
+    edge_cost = [edge_cost_list(map, type_preference) for type_preference in criteria]
+
+    # Labels by column: station, previous label, connection taken and costs
+    label_station, label_parent, label_edge, label_costs = [origin_id], [-1], [-1], [(0,) * len(criteria)]
+    alive = [True]
+    # Labels of every station that are not dominated
+    labels = {origin_id: [0]}
+    heap = [(label_costs[0], 0)]
+
+    while heap:
+        costs, label = heapq.heappop(heap)
+        if not alive[label]:
+            continue
+        station = label_station[label]
+        if station == destination_id:
+            continue
+
+        for edge in range(indptr[station], indptr[station + 1]):
+            connected = indices[edge]
+            new_costs = tuple(cost + table[edge] for cost, table in zip(costs, edge_cost))
+
+            # Dominated by a route to the destination or to the same station: it can not be optimal
+            if any(dominates(label_costs[other], new_costs) for other in labels.get(destination_id, ())):
+                continue
+            current = labels.get(connected, [])
+            if any(dominates(label_costs[other], new_costs) for other in current):
+                continue
+
+            for other in current:
+                if dominates(new_costs, label_costs[other]):
+                    alive[other] = False
+            new_label = len(label_station)
+            labels[connected] = [other for other in current if alive[other]] + [new_label]
+            label_station.append(connected)
+            label_parent.append(label)
+            label_edge.append(edge)
+            label_costs.append(new_costs)
+            alive.append(True)
+            heapq.heappush(heap, (new_costs, new_label))
+
+    front = []
+    for label in sorted(labels.get(destination_id, ()), key=lambda label: label_costs[label]):
+        edges = []
+        while label_parent[label] != -1:
+            edges.append(label_edge[label])
+            label = label_parent[label]
+        edges.reverse()
+        path = path_from_edges(origin_id, edges, map, criteria[0])
+        path.costs = tuple(sum_costs(edges, table) for table in edge_cost)
+        if 2 in criteria:
+            path.distance = path.costs[criteria.index(2)]
+        front.append(path)
+    return front
+
+
+def sum_costs(edges, table):
+    # Added one connection at a time, like calculate_cost
+    cost = 0
+    for edge in edges:
+        cost += table[edge]
+    return cost
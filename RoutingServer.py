@@ -0,0 +1,343 @@
+# Asynchronous HTTP/JSON routing server.
+#
+# The city is loaded once at startup. Requests are snapped to stations in the event loop and answered from the
+# route cache of the map when possible. Identical queries that are already being answered share the same result,
+# and the searches run in a pool of worker processes fed by a bounded queue: when the queue is full the server
+# answers 503 instead of piling up work.
+#
+# The map can be changed while the server runs with POST /update (see Map.update_connection and the methods after
+# it). Every search takes the changes that some worker may still miss with it, so a worker makes the ones its copy
+# of the map does not have before searching, and only routes found on the current map are cached.
+#
+# Usage: python RoutingServer.py [city_folder] [port] [processes] [queue_size]
+#
+#     GET  /route?origin=108,206&destination=67,79&type_preference=1
+#     POST /route  {"origin": [108, 206], "destination": [67, 79], "type_preference": 1}
+#     GET  /stats
+#     POST /update {"method": "update_connection", "args": [13, 14, 20]}
+#
+import sys
+import math
+import json
+import asyncio
+import concurrent.futures
+import functools
+from urllib.parse import urlsplit, parse_qs
+from BatchRouting import *
+
+ROOT_FOLDER = 'CityInformation/Lyon_bigCity/'
+
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+          503: 'Service Unavailable'}
+
+# Methods of Map that POST /update can call
+CHANGES = ('update_connection', 'remove_connection', 'restore_connection', 'update_line_velocity')
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class RoutingServer:
+    """
+    Answers route queries over HTTP/JSON for one Map.
+    Usage:
+        >>> server = RoutingServer(read_city(folder), city_folder=folder)
+        >>> await server.start('127.0.0.1', 8080)
+        >>> await server.serve_forever()
+    """
+
+    def __init__(self, map, city_folder=None, processes=None, queue_size=256):
+        self.map = map
+        self.processes = processes or multiprocessing.cpu_count()
+        self.queue = asyncio.Queue(queue_size)
+        # Queries being answered, by (origin ids, destination ids, type_preference, map version)
+        self.in_flight = {}
+        self.stats = {'requests': 0, 'searches': 0, 'coalesced': 0, 'rejected': 0, 'errors': 0, 'changes': 0}
+        # change_count() of the map of every worker that answered a search, by process id. The workers that did not
+        # answer yet have the changes of the map at startup.
+        self.worker_changes = {}
+        self.start_changes = map.change_count()
+
+        if self.processes == 1:
+            # Threads share this process' map, used by the tests and for small maps
+            self.executor = concurrent.futures.ThreadPoolExecutor(1)
+            self.search = functools.partial(route_group_changed, map=map)
+        else:
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                self.processes, initializer=init_worker,
+                initargs=(map if city_folder is None else None, city_folder, list(map.changes), None,
+                          map.changes_offset))
+            self.search = route_group_changed
+        self.workers = []
+        self.connections = {}
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=8080):
+        # One consumer per worker process, so the queue is only drained as fast as the searches finish
+        self.workers = [asyncio.ensure_future(self.consume()) for _ in range(self.processes)]
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+        # Closing the open connections lets their handlers finish instead of being cancelled
+        for writer in list(self.connections.values()):
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        if self.server is not None:
+            await self.server.wait_closed()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.executor.shutdown()
+
+    async def consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            key, future = await self.queue.get()
+            origin_id, destination_id, type_preference, _ = key
+            try:
+                task = (list(destination_id), [(0, list(origin_id))], type_preference, False)
+                # The worker makes every change up to now before searching
+                version = self.map.version
+                changes, start = self.missing_changes()
+                worker, worker_changes, [(_, route)] = await loop.run_in_executor(self.executor, self.search, task,
+                                                                                  changes, start)
+                self.worker_changes[worker] = max(self.worker_changes.get(worker, 0), worker_changes)
+                # Same key as SearchAlgorithm.cached_astar, only if the map did not change since the search
+                if version == self.map.version:
+                    self.map.route_cache.put(RouteKey('astar', origin_id, destination_id, type_preference), route)
+                future.set_result(route)
+            except Exception as error:
+                future.set_exception(error)
+            finally:
+                self.stats['searches'] += 1
+                del self.in_flight[key]
+                self.queue.task_done()
+
+    def missing_changes(self):
+        # The changes of the map from the oldest change a worker may miss on, and the change number of the first one
+        counts = list(self.worker_changes.values())
+        if len(counts) < self.processes:
+            counts.append(self.start_changes)
+        start = max(min(counts), self.map.changes_offset)
+        return self.map.changes[start - self.map.changes_offset:], start
+
+    async def route(self, origin_coor, dest_coor, type_preference=0):
+        """
+         Route between two coordinates, waiting for the search to finish.
+         Format of the parameter is:
+            Args:
+                origin_coor (list): Two REAL values, starting point
+                dest_coor (list): Two REAL values, final point
+                type_preference: INTEGER Value to indicate the preference selected (see Astar)
+            Returns:
+                result (dict): The JSON answer
+        """
+
+        origin_id = coord2station(origin_coor, self.map)
+        destination_id = coord2station(dest_coor, self.map)
+        key = (tuple(origin_id), tuple(destination_id), type_preference, self.map.version)
+
+        route = self.map.route_cache.get(RouteKey('astar', *key[:3]))
+        future = self.in_flight.get(key)
+        if route is not None:
+            return self.route_json(origin_id, destination_id, type_preference, route)
+        elif future is not None:
+            self.stats['coalesced'] += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            try:
+                self.queue.put_nowait((key, future))
+            except asyncio.QueueFull:
+                self.stats['rejected'] += 1
+                raise RequestError(503, 'Too many queries, try again later')
+            self.in_flight[key] = future
+
+        # Shielded, so a client that goes away does not cancel the query of the others
+        route = await asyncio.shield(future)
+        return self.route_json(origin_id, destination_id, type_preference, route)
+
+    async def update(self, method, args):
+        """
+         Changes the map with one of the CHANGES methods of Map. The cached routes it affects are dropped, and the
+         workers make the change before their next search.
+         Format of the parameter is:
+            Args:
+                method (str): Name of the method, e.g. 'update_connection'
+                args (list): Its arguments, e.g. [station, connected, cost]
+            Returns:
+                result (dict): The JSON answer, with the new version of the map
+        """
+
+        if method not in CHANGES:
+            raise RequestError(400, 'method must be one of {}'.format(', '.join(CHANGES)))
+        if not isinstance(args, list) or not all(isinstance(v, (int, float)) and not isinstance(v, bool)
+                                                 for v in args):
+            raise RequestError(400, 'args must be a list of numbers')
+        if method != 'update_line_velocity' and not all(isinstance(v, int) and v in self.map.stations
+                                                        for v in args[:2]):
+            raise RequestError(404, 'Unknown station')
+        if method == 'update_line_velocity' and args[:1] and args[0] not in getattr(self.map, 'velocity', {}):
+            raise RequestError(404, 'Unknown line')
+
+        change = functools.partial(getattr(self.map, method), *args)
+        try:
+            if self.processes == 1:
+                # The search thread reads the same map, the change waits for the search to finish
+                await asyncio.get_running_loop().run_in_executor(self.executor, change)
+            else:
+                change()
+        except KeyError:
+            raise RequestError(404, 'Unknown connection {}'.format(args[:2]))
+        except TypeError:
+            raise RequestError(400, 'Wrong number of args for {}'.format(method))
+        self.stats['changes'] += 1
+        return {'method': method, 'args': args, 'version': self.map.version}
+
+    def route_json(self, origin_id, destination_id, type_preference, route):
+        result = {'origin': origin_id, 'destination': destination_id, 'type_preference': type_preference,
+                  'route': None, 'stations': None, 'cost': None, 'transfers': None}
+        if isinstance(route, Path):
+            result.update(route=[int(s) for s in route.route],
+                          stations=[self.map.stations[s]['name'] for s in route.route],
+                          cost=float(route.g), transfers=int(getattr(route, 'transfers', 0)))
+        return result
+
+    async def handle_connection(self, reader, writer):
+        self.connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                try:
+                    status, result = 200, await self.dispatch(method, target, body)
+                except RequestError as error:
+                    status, result = error.status, {'error': str(error)}
+                except Exception as error:
+                    self.stats['errors'] += 1
+                    status, result = 500, {'error': repr(error)}
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await write_response(writer, status, result, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except RequestError as error:
+            await write_response(writer, error.status, {'error': str(error)}, False)
+        finally:
+            del self.connections[asyncio.current_task()]
+            writer.close()
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        if url.path == '/stats':
+            return dict(self.stats, queued=self.queue.qsize(), in_flight=len(self.in_flight),
+                        cache_hits=self.map.route_cache.hits, cache_misses=self.map.route_cache.misses,
+                        version=self.map.version)
+        if url.path == '/update':
+            if method != 'POST':
+                raise RequestError(405, 'Use POST')
+            try:
+                parameters = json.loads(body or b'{}')
+            except ValueError:
+                raise RequestError(400, 'The body is not valid JSON')
+            if not isinstance(parameters, dict):
+                raise RequestError(400, 'The body must be a JSON object')
+            return await self.update(parameters.get('method'), parameters.get('args', []))
+        if url.path != '/route':
+            raise RequestError(404, 'Unknown path {}'.format(url.path))
+
+        if method == 'GET':
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            parameters = {key: query[key].split(',') if key in ('origin', 'destination') else query[key]
+                          for key in query}
+        elif method == 'POST':
+            try:
+                parameters = json.loads(body or b'{}')
+            except ValueError:
+                raise RequestError(400, 'The body is not valid JSON')
+        else:
+            raise RequestError(405, 'Use GET or POST')
+
+        try:
+            origin = [float(v) for v in parameters['origin']]
+            destination = [float(v) for v in parameters['destination']]
+            type_preference = int(parameters.get('type_preference', 0))
+        except (KeyError, TypeError, ValueError):
+            raise RequestError(400, 'origin and destination must be two numbers each')
+        if len(origin) != 2 or len(destination) != 2 or type_preference not in range(4):
+            raise RequestError(400, 'origin and destination must be two numbers each, type_preference 0 to 3')
+        if not all(math.isfinite(v) for v in origin + destination):
+            raise RequestError(400, 'origin and destination must be finite numbers')
+
+        self.stats['requests'] += 1
+        return await self.route(origin, destination, type_preference)
+
+
+async def read_request(reader, max_body=1 << 20):
+    # Minimal HTTP/1.1 parsing: request line, headers and a Content-Length body. None at end of stream.
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode('latin-1').split()
+    except ValueError:
+        raise RequestError(400, 'Malformed request line')
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0) or 0)
+    except ValueError:
+        raise RequestError(400, 'Malformed Content-Length')
+    if length < 0:
+        raise RequestError(400, 'Malformed Content-Length')
+    if length > max_body:
+        raise RequestError(400, 'Body too large')
+    body = await reader.readexactly(length) if length else b''
+    return method, target, headers, body
+
+
+async def write_response(writer, status, result, keep_alive=True):
+    body = json.dumps(result).encode()
+    head = 'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n'.format(
+        status, STATUS.get(status, 'Internal Server Error'), len(body), 'keep-alive' if keep_alive else 'close')
+    if status == 503:
+        head += 'Retry-After: 1\r\n'
+    writer.write(head.encode() + b'\r\n' + body)
+    await writer.drain()
+
+
+async def main(folder=ROOT_FOLDER, port=8080, processes=None, queue_size=256):
+    server = RoutingServer(read_city(folder), city_folder=folder, processes=processes, queue_size=queue_size)
+    port = await server.start('127.0.0.1', port)
+    print("Serving {} on http://127.0.0.1:{}/route".format(folder, port))
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.run(main(args[0] if len(args) > 0 else ROOT_FOLDER,
+                     int(args[1]) if len(args) > 1 else 8080,
+                     int(args[2]) if len(args) > 2 else None,
+                     int(args[3]) if len(args) > 3 else 256))
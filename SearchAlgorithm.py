@@ -14,6 +14,10 @@ from utils import *
 import os
 import math
 import copy
+import time
+import heapq
+from collections import deque
+import numpy as np
 
 
 class CoolerPath(Path):
@@ -49,16 +53,237 @@ class CoolerPath(Path):
         self.transfers += v
 
 
+class SearchNode:
+    """
+    A compact node of the search tree. It only keeps a reference to its parent, the last station and
+    the map edge that reaches it, so expanding a node does not copy the route. The route is rebuilt
+    with to_path() once the search returns its result.
+    Usage:
+        >>> node = SearchNode(2)
+        >>> child = SearchNode(5, node)
+        >>> child.route, child.penultimate
+        ([2, 5], 2)
+        >>> child.to_path() == Path([2, 5])
+        True
+    """
+
+    __slots__ = ('parent', 'last', 'edge', 'depth', 'transfers', 'g', 'h', 'f')
+
+    def __init__(self, last, parent=None, edge=None):
+        self.parent = parent
+        self.last = last
+        self.edge = edge
+
+        if parent is None:
+            self.depth = 0
+            self.transfers = 0
+            self.g = 0
+            self.h = 0
+            self.f = 0
+        else:
+            self.depth = parent.depth + 1
+            self.transfers = parent.transfers
+            self.g = parent.g
+            self.h = parent.h
+            self.f = parent.f
+
+    def __lt__(self, other):
+        # Lexicographic order of the two routes, walking up to the common ancestor instead of building them
+        if self.depth < other.depth:
+            other = other.ancestor(self.depth)
+            if other is self:
+                return True
+        elif self.depth > other.depth:
+            node = self.ancestor(other.depth)
+            if node is other:
+                return False
+            return node < other
+
+        node = self
+        while node.parent is not other.parent:
+            node = node.parent
+            other = other.parent
+        return node.last < other.last
+
+    @property
+    def penultimate(self):
+        return self.parent.last
+
+    @property
+    def head(self):
+        return self.ancestor(0).last
+
+    @property
+    def route(self):
+        route = [None] * (self.depth + 1)
+        node = self
+        while node is not None:
+            route[node.depth] = node.last
+            node = node.parent
+        return route
+
+    def ancestor(self, depth):
+        node = self
+        while node.depth > depth:
+            node = node.parent
+        return node
+
+    def is_cyclic(self):
+        # The parent is always acyclic, so only the last station can be repeated
+        node = self.parent
+        while node is not None:
+            if node.last == self.last:
+                return True
+            node = node.parent
+        return False
+
+    def update_transfers(self, v):
+        self.transfers += v
+
+    def update_h(self, h):
+        self.h = h
+
+    def update_g(self, g):
+        self.g += g
+
+    def update_f(self):
+        self.f = self.g + self.h
+
+    def to_path(self):
+        path = CoolerPath(self.route)
+        path.transfers = self.transfers
+        path.g = self.g
+        path.h = self.h
+        path.f = self.f
+        return path
+
+
+class SearchStats:
+    """
+    Counters and timings of the searches it is given to (depth_first_search, breadth_first_search,
+    uniform_cost_search and Astar). The numbers add up over all those searches.
+        expanded, generated: paths expanded and paths created by expand
+        cycles_pruned: paths dropped by remove_cycles
+        redundant_pruned: paths dropped because a cheaper path (or, with visited, any path) reached a station first
+        peak_frontier: largest number of paths waiting to be expanded
+        times: seconds spent in every phase of the searches ('expand', 'remove_cycles', 'cost', ...)
+    callback(stats) is called at the end of every search, e.g. to export the numbers to a metrics system.
+    Without a SearchStats the searches only check that stats is None.
+    Usage:
+        >>> stats = SearchStats(callback=lambda stats: print(stats.as_dict()))
+        >>> route = Astar([108, 206], [67, 79], map, 1, stats=stats)
+        >>> stats.expanded, stats.times['expand']
+    """
+
+    def __init__(self, callback=None, clock=time.perf_counter):
+        self.callback = callback
+        self.clock = clock
+        self.algorithm = None
+        self.searches = 0
+        self.found = 0
+        self.expanded = 0
+        self.generated = 0
+        self.cycles_pruned = 0
+        self.redundant_pruned = 0
+        self.peak_frontier = 0
+        self.times = {}
+        self.total_time = 0.0
+        self.running = False
+        self.started = self.last_lap = 0.0
+
+    def start(self, algorithm):
+        # A search started by another one (Astar calls astar_search) keeps the clock of the first one
+        if not self.running:
+            self.running = True
+            self.algorithm = algorithm
+            self.started = self.last_lap = self.clock()
+
+    def lap(self, phase):
+        now = self.clock()
+        self.times[phase] = self.times.get(phase, 0.0) + now - self.last_lap
+        self.last_lap = now
+
+    def expansion(self, expanded):
+        self.expanded += 1
+        self.generated += len(expanded)
+        self.lap('expand')
+
+    def pruned_cycles(self, before, after):
+        self.cycles_pruned += len(before) - len(after)
+        self.lap('remove_cycles')
+
+    def pruned_redundant(self, before, after, phase='remove_redundant'):
+        self.redundant_pruned += len(before) - len(after)
+        self.lap(phase)
+
+    def frontier(self, size):
+        self.peak_frontier = max(self.peak_frontier, size)
+        self.lap('frontier')
+
+    def finish(self, route):
+        self.lap('frontier')
+        self.total_time += self.last_lap - self.started
+        self.searches += 1
+        self.found += isinstance(route, Path)
+        self.running = False
+        if self.callback is not None:
+            self.callback(self)
+
+    def as_dict(self):
+        return {'algorithm': self.algorithm, 'searches': self.searches, 'found': self.found,
+                'expanded': self.expanded, 'generated': self.generated, 'cycles_pruned': self.cycles_pruned,
+                'redundant_pruned': self.redundant_pruned, 'peak_frontier': self.peak_frontier,
+                'times': dict(self.times), 'total_time': self.total_time}
+
+
+def finish_search(stats, route):
+    if stats is not None:
+        stats.finish(route)
+    return route
+
+
+class PathHeap:
+    """
+    A priority queue of paths backed by heapq.
+    Paths are popped in the same order as sorting the whole frontier with the key [cost, route],
+    where the cost is path.g (uniform cost search) or path.f (A*).
+    Usage:
+        >>> frontier = PathHeap('f')
+        >>> frontier.push(path)
+        >>> best = frontier.pop()
+    """
+
+    def __init__(self, cost='g', paths=()):
+        self.cost = cost
+        self.heap = [(getattr(p, cost), p) for p in paths]
+        heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, path):
+        # Ties on the cost are broken by the route order of the paths themselves
+        heapq.heappush(self.heap, (getattr(path, self.cost), path))
+
+    def pop(self):
+        if self.heap:
+            return heapq.heappop(self.heap)[-1]
+        return None
+
+    def paths(self):
+        return [entry[-1] for entry in self.heap]
+
+
 def get_maximum_velocity(map):
-    MAX_VELOCITY = max([map.stations[s]["velocity"] for s in map.stations])
-    return MAX_VELOCITY
+    if map.max_velocity is None:
+        map.max_velocity = max([map.stations.velocity[s] for s in map.stations])
+    return map.max_velocity
 
 
 def calculate_distance(path_of_origin, destination_id, map):
-    last_station = map.stations[path_of_origin.last]
-    destination = map.stations[destination_id]
-    coord_last = [last_station["x"], last_station["y"]]
-    coord_destination = [destination["x"], destination["y"]]
+    stations = map.stations
+    coord_last = [stations.x[path_of_origin.last], stations.y[path_of_origin.last]]
+    coord_destination = [stations.x[destination_id], stations.y[destination_id]]
     return euclidean_dist(coord_destination, coord_last)
 
 
@@ -75,11 +300,23 @@ def expand(path, map):
 
     expanded = []
 
+    if type(path) is SearchNode:
+        # Transfer flag of every connection, see Map.calculate_edge_costs
+        transfers = edge_cost_list(map, 3)
+        for edge, i in map.neighbours(path.last):
+            new_path = SearchNode(i, path, edge)
+            if transfers[edge]:
+                new_path.update_transfers(1)
+            expanded.append(new_path)
+        return expanded
+
+    # Stations with the same name_id have the same name
+    name_id = map.stations.name_id
     for i in map.connections[path.last]:
         new_path = CoolerPath(path)
         new_path.add_route(i)
 
-        if map.stations[new_path.last]["name"] == map.stations[new_path.penultimate]["name"]:
+        if name_id[new_path.last] == name_id[new_path.penultimate]:
             new_path.update_transfers(1)
 
         expanded.append(new_path)
@@ -87,6 +324,22 @@ def expand(path, map):
     return expanded
 
 
+def connection_cost(path, map):
+    """
+     Cost of the last connection of a path, read from the CSR arrays when the path knows its edge.
+     Format of the parameter is:
+        Args:
+            path (object of Path class): Path with at least two stations
+            map (object of Map class): All the map information
+        Returns:
+            cost (float): Value of the cost table between path.penultimate and path.last
+    """
+
+    if type(path) is SearchNode:
+        return map.weights[path.edge]
+    return map.connections[path.penultimate][path.last]
+
+
 def remove_cycles(path_list):
     """
      It removes from path_list the set of paths that include some cycles in their path.
@@ -100,8 +353,10 @@ def remove_cycles(path_list):
     uncycled = []
 
     for path in path_list:
-        route = path.route
-        if len(route) == len(set(route)):
+        if type(path) is SearchNode:
+            if not path.is_cyclic():
+                uncycled.append(path)
+        elif len(path.route) == len(set(path.route)):
             uncycled.append(path)
 
     return uncycled
@@ -121,7 +376,37 @@ def insert_depth_first_search(expand_paths, list_of_path):
     return list(expand_paths + list_of_path)
 
 
-def depth_first_search(origin_id, destination_id, map):
+def push_depth_first_search(expand_paths, stack):
+    """
+     expand_paths is pushed to the stack according to DEPTH FIRST SEARCH algorithm.
+     The top of the stack is its last element, so the first expanded path is pushed last.
+     Format of the parameter is:
+        Args:
+            expand_paths (LIST of Path Class): Expanded paths
+            stack (LIST of Path Class): The paths to be visited
+        Returns:
+            stack (LIST of Path Class): Stack where Expanded Path is pushed
+    """
+
+    stack.extend(reversed(expand_paths))
+    return stack
+
+
+def remove_visited(path_list, visited):
+    """
+     It removes from path_list the paths whose last station has already been visited.
+     Format of the parameter is:
+        Args:
+            path_list (LIST of Path Class): Expanded paths
+            visited (set): Stations already visited by the search
+        Returns:
+            path_list (list): Expanded paths that reach a new station.
+    """
+
+    return [path for path in path_list if path.last not in visited]
+
+
+def depth_first_search(origin_id, destination_id, map, visited=False, stats=None):
     """
      Depth First Search algorithm
      Format of the parameter is:
@@ -129,22 +414,41 @@ def depth_first_search(origin_id, destination_id, map):
             origin_id (int): Starting station id
             destination_id (int): Final station id
             map (object of Map class): All the map information
+            visited (bool): If True, every station is expanded at most once instead of once per acyclic path
+            stats (SearchStats): If given, it records the work done by the search
         Returns:
             list_of_path[0] (Path Class): the route that goes from origin_id to destination_id
     """
 
-    paths = [CoolerPath(origin_id)]
-
-    while paths and paths[0].last != destination_id:
-        expanded = expand(paths[0], map)
-        uncycled = remove_cycles(expanded)
-        paths.pop(0)
-        paths = insert_depth_first_search(uncycled, paths)
+    if stats is not None:
+        stats.start('depth_first_search')
+    paths = [SearchNode(origin_id)]
+    visited_stations = set() if visited else None
+
+    while paths:
+        path = paths.pop()
+        if path.last == destination_id:
+            return finish_search(stats, path.to_path())
+        if visited_stations is not None and path.last in visited_stations:
+            continue
+
+        expanded = expand(path, map)
+        if stats is not None:
+            stats.expansion(expanded)
+        if visited_stations is None:
+            uncycled = remove_cycles(expanded)
+            if stats is not None:
+                stats.pruned_cycles(expanded, uncycled)
+        else:
+            visited_stations.add(path.last)
+            uncycled = remove_visited(expanded, visited_stations)
+            if stats is not None:
+                stats.pruned_redundant(expanded, uncycled, 'remove_visited')
+        paths = push_depth_first_search(uncycled, paths)
+        if stats is not None:
+            stats.frontier(len(paths))
 
-    if paths:
-        return paths[0]
-    else:
-        return []
+    return finish_search(stats, [])
 
 
 def insert_breadth_first_search(expand_paths, list_of_path):
@@ -161,7 +465,7 @@ def insert_breadth_first_search(expand_paths, list_of_path):
     return list(list_of_path + expand_paths)
 
 
-def breadth_first_search(origin_id, destination_id, map):
+def breadth_first_search(origin_id, destination_id, map, visited=False, stats=None):
     """
      Breadth First Search algorithm
      Format of the parameter is:
@@ -169,22 +473,40 @@ def breadth_first_search(origin_id, destination_id, map):
             origin_id (int): Starting station id
             destination_id (int): Final station id
             map (object of Map class): All the map information
+            visited (bool): If True, every station is queued at most once instead of once per acyclic path.
+                            The first path to reach a station is kept, so the returned route is the same.
+            stats (SearchStats): If given, it records the work done by the search
         Returns:
             list_of_path[0] (Path Class): The route that goes from origin_id to destination_id
     """
 
-    paths = [CoolerPath(origin_id)]
-
-    while paths and paths[0].last != destination_id:
-        expanded = expand(paths[0], map)
-        uncycled = remove_cycles(expanded)
-        paths.pop(0)
-        paths = insert_breadth_first_search(uncycled, paths)
+    if stats is not None:
+        stats.start('breadth_first_search')
+    paths = deque([SearchNode(origin_id)])
+    visited_stations = {origin_id} if visited else None
+
+    while paths:
+        path = paths.popleft()
+        if path.last == destination_id:
+            return finish_search(stats, path.to_path())
+
+        expanded = expand(path, map)
+        if stats is not None:
+            stats.expansion(expanded)
+        if visited_stations is None:
+            kept = remove_cycles(expanded)
+            if stats is not None:
+                stats.pruned_cycles(expanded, kept)
+        else:
+            kept = remove_visited(expanded, visited_stations)
+            visited_stations.update(p.last for p in kept)
+            if stats is not None:
+                stats.pruned_redundant(expanded, kept, 'remove_visited')
+        paths.extend(kept)
+        if stats is not None:
+            stats.frontier(len(paths))
 
-    if paths:
-        return paths[0]
-    else:
-        return []
+    return finish_search(stats, [])
 
 
 def calculate_cost(expand_paths, map, type_preference=0):
@@ -203,36 +525,114 @@ def calculate_cost(expand_paths, map, type_preference=0):
                 expand_paths (LIST of Paths): Expanded path with updated cost
     """
 
-    if type_preference == 0:
+    if expand_paths and type(expand_paths[0]) is SearchNode and type_preference in (0, 1, 2, 3):
+        # The cost of every connection is precomputed, see Map.calculate_edge_costs
+        costs = edge_cost_list(map, type_preference)
+        for path in expand_paths:
+            path.update_g(costs[path.edge])
+
+    elif type_preference == 0:
         for path in expand_paths:
             path.update_g(1)
 
     elif type_preference == 1:
         for path in expand_paths:
-            g = map.connections[path.penultimate][path.last]
+            g = connection_cost(path, map)
             path.update_g(g)
 
     elif type_preference == 2:
+        name_id, velocities = map.stations.name_id, map.stations.velocity
         for path in expand_paths:
-            if map.stations[path.last]["name"] == map.stations[path.penultimate]["name"]:
+            if name_id[path.last] == name_id[path.penultimate]:
                 velocity = 0
             else:
-                velocity = map.stations[path.last]["velocity"]
-            seconds = map.connections[path.penultimate][path.last]
+                velocity = velocities[path.last]
+            seconds = connection_cost(path, map)
             g = velocity * seconds
             path.update_g(g)
 
     elif type_preference == 3:
+        name_id = map.stations.name_id
         for path in expand_paths:
             # try:
             #     path.g = path.transfers
             # except:
-            if map.stations[path.last]["name"] == map.stations[path.penultimate]["name"]:
+            if name_id[path.last] == name_id[path.penultimate]:
                 path.update_g(1)
 
     return expand_paths
 
 
+def edge_costs(map, type_preference=0):
+    """
+     Cost of every connection of the map according to type preference, with the same values calculate_cost
+     adds to a path that takes that connection.
+     Format of the parameter is:
+        Args:
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected:
+                            0 - Adjacency
+                            1 - minimum Time
+                            2 - minimum Distance
+                            3 - minimum Transfers
+        Returns:
+            costs (array): costs[edge] is the cost of the edge in position edge of map.indices
+    """
+
+    if type_preference not in map.edge_cost_tables:
+        map.edge_cost_tables[type_preference] = map.calculate_edge_costs(type_preference)
+    return map.edge_cost_tables[type_preference]
+
+
+def edge_cost_list(map, type_preference=0):
+    """
+     The costs of edge_costs as a Python list, which is faster to read one edge at a time in the searches.
+     edge_cost_list(map, 3) is the transfer flag of every connection.
+    """
+
+    if type_preference not in map.edge_cost_lists:
+        map.edge_cost_lists[type_preference] = edge_costs(map, type_preference).tolist()
+    return map.edge_cost_lists[type_preference]
+
+
+def dijkstra(indptr, indices, costs, sources):
+    """
+     One-to-all shortest paths over a graph in CSR form. Costs are added along the route in the same order
+     as Path.update_g, so dist[s] is exactly the g of the best path that ends in s.
+     Format of the parameter is:
+        Args:
+            indptr, indices (arrays): Graph in CSR form, indexed by station id (see Map)
+            costs (array): Cost of every edge
+            sources (list): Station ids where the search starts with cost 0
+        Returns:
+            dist (array): Cost of the best path to every station (inf if it can not be reached)
+            pred (array): Previous station in that path (-1 for the sources and unreached stations)
+    """
+
+    indptr, indices, costs = indptr.tolist(), indices.tolist(), costs.tolist()
+    dist = [math.inf] * (len(indptr) - 1)
+    pred = [-1] * (len(indptr) - 1)
+    heap = []
+    for source in sources:
+        dist[source] = 0
+        heap.append((0, source))
+    heapq.heapify(heap)
+
+    while heap:
+        d, station = heapq.heappop(heap)
+        if d > dist[station]:
+            continue
+        for edge in range(indptr[station], indptr[station + 1]):
+            connected = indices[edge]
+            new_d = d + costs[edge]
+            if new_d < dist[connected]:
+                dist[connected] = new_d
+                pred[connected] = station
+                heapq.heappush(heap, (new_d, connected))
+
+    return np.array(dist, dtype=np.float64), np.array(pred, dtype=np.int64)
+
+
 def insert_cost(expand_paths, list_of_path):
     """
         expand_paths is inserted to the list_of_path according to COST VALUE
@@ -249,7 +649,24 @@ def insert_cost(expand_paths, list_of_path):
     return list_of_path
 
 
-def uniform_cost_search(origin_id, destination_id, map, type_preference=0):
+def insert_cost_heap(expand_paths, frontier):
+    """
+        expand_paths is pushed to the frontier heap according to COST VALUE.
+        It keeps the same order as insert_cost but every insertion is O(log n).
+        Format of the parameter is:
+           Args:
+               expand_paths (LIST of Path Class): Expanded paths
+               frontier (PathHeap): The paths to be visited, ordered by g
+           Returns:
+               frontier (PathHeap): Frontier where expanded_path is inserted according to cost
+    """
+
+    for path in expand_paths:
+        frontier.push(path)
+    return frontier
+
+
+def uniform_cost_search(origin_id, destination_id, map, type_preference=0, stats=None):
     """
      Uniform Cost Search algorithm
      Format of the parameter is:
@@ -257,26 +674,286 @@ def uniform_cost_search(origin_id, destination_id, map, type_preference=0):
             origin_id (int): Starting station id
             destination_id (int): Final station id
             map (object of Map class): All the map information
+            stats (SearchStats): If given, it records the work done by the search
         Returns:
             list_of_path[0] (Path Class): The route that goes from origin_id to destination_id
     """
 
-    paths = [CoolerPath(origin_id)]
+    if stats is not None:
+        stats.start('uniform_cost_search')
+    frontier = PathHeap('g')
+    path = SearchNode(origin_id)
 
-    while paths and paths[0].last != destination_id:
-        expanded = expand(paths[0], map)
+    while path is not None and path.last != destination_id:
+        expanded = expand(path, map)
+        if stats is not None:
+            stats.expansion(expanded)
         uncycled = remove_cycles(expanded)
-        paths.pop(0)
+        if stats is not None:
+            stats.pruned_cycles(expanded, uncycled)
         with_cost = calculate_cost(uncycled, map, type_preference)
-        paths = insert_cost(with_cost, paths)
-
-    if paths:
-        return paths[0]
+        if stats is not None:
+            stats.lap('cost')
+        frontier = insert_cost_heap(with_cost, frontier)
+        if stats is not None:
+            stats.frontier(len(frontier))
+        path = frontier.pop()
+
+    if path is not None:
+        return finish_search(stats, path.to_path())
     else:
+        return finish_search(stats, [])
+
+
+def cached_uniform_cost_search(origin_id, destination_id, map, type_preference=0):
+    """
+     uniform_cost_search with the routes kept in map.route_cache, which is emptied when the map changes.
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            destination_id (int): Final station id
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected (see calculate_cost)
+        Returns:
+            list_of_path[0] (Path Class): The route that goes from origin_id to destination_id
+    """
+
+    key = RouteKey('ucs', origin_id, destination_id, type_preference)
+    return cached_route(map, key, lambda: uniform_cost_search(origin_id, destination_id, map, type_preference))
+
+
+def cached_route(map, key, search):
+    # Callers get their own copy, so changing a route does not change the cached one
+    route = map.route_cache.get(key)
+    if route is None:
+        route = search()
+        map.route_cache.put(key, route)
+    return CoolerPath(route) if isinstance(route, Path) else []
+
+
+def bidirectional_uniform_cost_search(origin_id, destination_id, map, type_preference=0):
+    """
+     Bidirectional Uniform Cost Search algorithm: one search goes forward from origin_id and another one goes
+     backward from destination_id over the reversed connections, always advancing the one with the lowest cost.
+     Every type_preference has non-negative costs (transfers and time can be 0), so the best route is known as
+     soon as the lowest costs of both frontiers add up to at least the best meeting found so far.
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            destination_id (int): Final station id
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected (see calculate_cost)
+        Returns:
+            list_of_path[0] (Path Class): The route that goes from origin_id to destination_id
+    """
+
+    costs = edge_costs(map, type_preference)
+    neighbours = (map.neighbours, map.reverse_neighbours)
+    dist = ({origin_id: 0}, {destination_id: 0})
+    # Edge used to reach every station, forward from the origin or backward from the destination
+    pred = ({origin_id: None}, {destination_id: None})
+    frontiers = ([(0, origin_id)], [(0, destination_id)])
+    best, meeting = (0, origin_id) if origin_id == destination_id else (math.inf, None)
+
+    while frontiers[0] and frontiers[1] and frontiers[0][0][0] + frontiers[1][0][0] < best:
+        side = 0 if frontiers[0][0][0] <= frontiers[1][0][0] else 1
+        d, station = heapq.heappop(frontiers[side])
+        if d > dist[side][station]:
+            continue
+
+        for edge, connected in neighbours[side](station):
+            new_d = d + costs[edge]
+            if new_d < dist[side].get(connected, math.inf):
+                dist[side][connected] = new_d
+                pred[side][connected] = (edge, station)
+                heapq.heappush(frontiers[side], (new_d, connected))
+                if connected in dist[1 - side] and new_d + dist[1 - side][connected] < best:
+                    best, meeting = new_d + dist[1 - side][connected], connected
+
+    if meeting is None:
         return []
 
+    edges = []
+    station = meeting
+    while pred[0][station] is not None:
+        edge, station = pred[0][station]
+        edges.append(edge)
+    edges.reverse()
+    station = meeting
+    while pred[1][station] is not None:
+        edge, station = pred[1][station]
+        edges.append(edge)
+
+    return path_from_edges(origin_id, edges, map, type_preference)
+
+
+def path_from_edges(origin_id, edges, map, type_preference=0):
+    """
+     Builds the CoolerPath that starts in origin_id and follows the given connections, adding their costs
+     one by one as calculate_cost does.
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            edges (list): Positions in map.indices of the connections of the route, in order
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected (see calculate_cost)
+        Returns:
+            path (CoolerPath): The route with its g and transfers
+    """
+
+    costs = edge_costs(map, type_preference)
+    transfers = edge_costs(map, 3)
+    path = CoolerPath(origin_id)
+    for edge in edges:
+        path.add_route(int(map.indices[edge]))
+        path.update_g(costs[edge])
+        path.update_transfers(int(transfers[edge]))
+    return path
+
+
+class ShortestPathTree:
+    """
+    Best routes from one origin to every station for one type_preference.
+    dist[s] is the cost of the best route to station s (inf if it can not be reached) and pred[s] the station
+    before s in that route. Routes are only built when they are asked for.
+    Usage:
+        >>> tree = shortest_path_tree(9, map, type_preference=1)
+        >>> tree.dist[3]
+        >>> tree.route(3)
+    """
+
+    def __init__(self, origin_id, map, type_preference, dist, pred):
+        self.origin_id = origin_id
+        self.map = map
+        self.type_preference = type_preference
+        self.dist = dist
+        self.pred = pred
+        self.children = None
+
+    def reachable(self, destination_id):
+        return destination_id < len(self.dist) and not math.isinf(self.dist[destination_id])
+
+    def route(self, destination_id):
+        """
+        Returns the best route from the origin to destination_id as a CoolerPath ([] if it can not be reached).
+        """
+        if not self.reachable(destination_id):
+            return []
+
+        edges = []
+        station = destination_id
+        while station != self.origin_id:
+            previous = int(self.pred[station])
+            edges.append(self.map.edge_index(previous, station))
+            station = previous
+        edges.reverse()
+        return path_from_edges(self.origin_id, edges, self.map, self.type_preference)
+
+    def update_connection(self, station, connected):
+        """
+        Repairs the tree after the cost of the connection from station to connected changed in the map (or it
+        was removed or restored), with the same dist as a new search. Only the stations whose best route may
+        change are visited: the ones it improves when the cost goes down, and the subtree under the connection
+        when it goes up.
+        """
+        costs = edge_cost_list(self.map, self.type_preference)
+        edge = self.map.edge_index(station, connected)
+        cost = math.inf if edge is None else costs[edge]
+        dist, pred = self.dist, self.pred
+
+        if dist[station] + cost < dist[connected]:
+            dist[connected] = dist[station] + cost
+            self.set_pred(connected, station)
+            self.propagate([(dist[connected], connected)], costs)
+        elif pred[connected] == station:
+            # Every station of the subtree gets its best route from the rest of the tree, then they improve
+            # each other
+            subtree = self.subtree(connected)
+            for s in subtree:
+                dist[s] = math.inf
+            heap = []
+            for s in subtree:
+                best, best_pred = math.inf, -1
+                for e, source in self.map.reverse_neighbours(s):
+                    if dist[source] + costs[e] < best:
+                        best, best_pred = dist[source] + costs[e], source
+                self.set_pred(s, best_pred)
+                if best_pred != -1:
+                    dist[s] = best
+                    heap.append((best, s))
+            heapq.heapify(heap)
+            self.propagate(heap, costs)
+
+    def propagate(self, heap, costs):
+        # Dijkstra from the stations in heap, only through the stations it improves
+        indptr, indices, _ = self.map.csr_lists()
+        dist = self.dist
+        while heap:
+            d, station = heapq.heappop(heap)
+            if d > dist[station]:
+                continue
+            for edge in range(indptr[station], indptr[station + 1]):
+                connected = indices[edge]
+                new_d = d + costs[edge]
+                if new_d < dist[connected]:
+                    dist[connected] = new_d
+                    self.set_pred(connected, station)
+                    heapq.heappush(heap, (new_d, connected))
+
+    def children_of(self):
+        # Stations whose pred is every station, built the first time the tree is repaired
+        if self.children is None:
+            self.children = [[] for _ in range(len(self.pred))]
+            for s, previous in enumerate(self.pred.tolist()):
+                if previous != -1:
+                    self.children[previous].append(s)
+        return self.children
+
+    def set_pred(self, station, previous):
+        children = self.children_of()
+        if self.pred[station] != -1:
+            children[self.pred[station]].remove(station)
+        if previous != -1:
+            children[previous].append(station)
+        self.pred[station] = previous
+
+    def subtree(self, station):
+        children = self.children_of()
+        subtree = [station]
+        for s in subtree:
+            subtree.extend(children[s])
+        return subtree
+
+
+def shortest_path_tree(origin_id, map, type_preference=0, maxsize=64):
+    """
+     One-to-all Uniform Cost Search: the best route from origin_id to every station, with the costs of
+     calculate_cost. Trees are kept in map.shortest_path_trees and the least recently used ones are dropped
+     beyond maxsize, so repeated queries from the same origin do not search again.
+     Format of the parameter is:
+        Args:
+            origin_id (int): Starting station id
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected (see calculate_cost)
+            maxsize (int): Maximum number of trees kept in the map
+        Returns:
+            tree (ShortestPathTree): Distance and predecessor of every station
+    """
+
+    key = TreeKey(origin_id, type_preference)
+    trees = map.shortest_path_trees
+    if key in trees:
+        trees.move_to_end(key)
+        return trees[key]
+
+    dist, pred = dijkstra(map.indptr, map.indices, edge_costs(map, type_preference), [origin_id])
+    trees[key] = ShortestPathTree(origin_id, map, type_preference, dist, pred)
+    if len(trees) > maxsize:
+        trees.popitem(last=False)
+    return trees[key]
 
-def calculate_heuristics(expand_paths, map, destination_id, type_preference=0):
+
+def calculate_heuristics(expand_paths, map, destination_id, type_preference=0, landmarks=False):
     """
      Calculate and UPDATE the heuristics of a path according to type preference
      WARNING: In calculate_cost, we didn't update the cost of the path inside the function
@@ -290,38 +967,130 @@ def calculate_heuristics(expand_paths, map, destination_id, type_preference=0):
                             1 - minimum Time
                             2 - minimum Distance
                             3 - minimum Transfers
+            landmarks (bool): Also use the landmark lower bounds, if preprocess_landmarks was run for type_preference
         Returns:
             expand_paths (LIST of Path Class): Expanded paths with updated heuristics
     """
-    if type_preference == 0:
+    if type_preference in (0, 1, 2, 3):
+        table = heuristic_table(map, destination_id, type_preference, landmarks)
         for path in expand_paths:
-            if path.last == destination_id:
-                h = 0
-            else:
-                h = 1
-            path.update_h(h)
+            path.update_h(table[path.last])
 
-    elif type_preference == 1:
-        for path in expand_paths:
-            velocity = get_maximum_velocity(map)
-            distance = calculate_distance(path, destination_id, map)
-            h = distance / velocity
-            path.update_h(h)
+    return expand_paths
 
-    elif type_preference == 2:
-        for path in expand_paths:
-            h = calculate_distance(path, destination_id, map)
-            path.update_h(h)
 
+def heuristic_table(map, destination_id, type_preference=0, landmarks=False, maxsize=None):
+    """
+     Heuristics of every station towards destination_id, computed for all stations at once and cached
+     in map.heuristic_tables (the least recently used tables are dropped beyond maxsize).
+     The values are the same ones calculate_heuristics used to compute path by path.
+     Format of the parameter is:
+        Args:
+            map (object of Map class): All the map information
+            destination_id (int): Final station id
+            type_preference: INTEGER Value to indicate the preference selected:
+                            0 - Adjacency
+                            1 - minimum Time
+                            2 - minimum Distance
+                            3 - minimum Transfers
+            landmarks (bool): Take the maximum with the landmark lower bounds, if they were preprocessed
+            maxsize (int): Maximum number of tables kept in the map (default: map.heuristic_tables_maxsize)
+        Returns:
+            table (list): table[station_id] is the heuristic of a path that ends in station_id
+    """
+
+    landmarks = landmarks and type_preference in map.landmarks
+    key = HeuristicKey(destination_id, type_preference, landmarks)
+    tables = map.heuristic_tables
+    if key in tables:
+        tables.move_to_end(key)
+        return tables[key]
+
+    x, y, line = map.station_arrays()
+    if type_preference == 0:
+        table = np.ones(len(x), dtype=np.int64)
+        table[destination_id] = 0
     elif type_preference == 3:
-        for path in expand_paths:
-            if map.stations[path.last]["line"] == map.stations[destination_id]["line"]:
-                h = 0
-            else:
-                h = 1
-            path.update_h(h)
+        table = (line != line[destination_id]).astype(np.int64)
+    else:
+        table = np.sqrt((x[destination_id] - x) ** 2 + (y[destination_id] - y) ** 2)
+        if type_preference == 1:
+            table = table / get_maximum_velocity(map)
 
-    return expand_paths
+    if landmarks:
+        bounds = landmark_bounds(map, destination_id, type_preference)
+        size = min(len(table), len(bounds))
+        table = table.astype(np.float64)
+        table[:size] = np.maximum(table[:size], bounds[:size])
+
+    tables[key] = table.tolist()
+    if maxsize is None:
+        maxsize = map.heuristic_tables_maxsize
+    while len(tables) > max(maxsize, 1):
+        tables.popitem(last=False)
+    return tables[key]
+
+
+def preprocess_landmarks(map, type_preference=1, k=8):
+    """
+     Landmark (ALT) preprocessing: it picks k landmarks far away from each other and stores the cost from and to
+     every landmark in the map, so that landmark_bounds can be used as an admissible heuristic.
+     Format of the parameter is:
+        Args:
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected (see calculate_cost)
+            k (int): Number of landmarks
+        Returns:
+            landmarks (list): Ids of the chosen landmarks
+    """
+
+    costs = edge_costs(map, type_preference)
+    reverse_indptr, reverse_sources, reverse_edges = map.reverse_csr()
+    reverse_costs = costs[reverse_edges]
+
+    landmarks, dist_from, dist_to = [], [], []
+    # The first landmark is the station furthest from an arbitrary one, the next ones the furthest from all chosen
+    distance, _ = dijkstra(map.indptr, map.indices, costs, [next(iter(map.stations))])
+    closest = np.full(len(distance), math.inf)
+    for _ in range(min(k, len(map.stations))):
+        candidates = np.where(np.isfinite(distance), distance, -1)
+        candidates[landmarks] = -1
+        landmark = int(np.argmax(candidates))
+        if candidates[landmark] < 0:
+            break
+        landmarks.append(landmark)
+        dist_from.append(dijkstra(map.indptr, map.indices, costs, [landmark])[0])
+        dist_to.append(dijkstra(reverse_indptr, reverse_sources, reverse_costs, [landmark])[0])
+        closest = np.minimum(closest, np.minimum(dist_from[-1], dist_to[-1]))
+        distance = closest
+
+    map.add_landmarks(type_preference, landmarks, np.array(dist_from), np.array(dist_to))
+    return landmarks
+
+
+def landmark_bounds(map, destination_id, type_preference=1):
+    """
+     Lower bound of the cost from every station to destination_id given by the triangle inequality:
+        cost(s, t) >= cost(L, t) - cost(L, s)   and   cost(s, t) >= cost(s, L) - cost(t, L)
+     Format of the parameter is:
+        Args:
+            map (object of Map class): All the map information, with landmarks for type_preference
+            destination_id (int): Final station id
+            type_preference: INTEGER Value to indicate the preference selected (see calculate_cost)
+        Returns:
+            bounds (array): bounds[station_id] is a lower bound of the cost from station_id to destination_id
+    """
+
+    _, dist_from, dist_to = map.landmarks[type_preference]
+    with np.errstate(invalid='ignore'):
+        forward = dist_from[:, destination_id:destination_id + 1] - dist_from
+        backward = dist_to - dist_to[:, destination_id:destination_id + 1]
+    bounds = np.nan_to_num(np.maximum(forward, backward), nan=0.0, posinf=0.0, neginf=0.0)
+    bounds = bounds.max(axis=0, initial=0.0)
+    if type_preference in (1, 2):
+        # Leave room for the rounding of the differences, so the bound never exceeds the real cost
+        bounds = bounds * (1 - 1e-9)
+    return bounds
 
 
 def update_f(expand_paths):
@@ -353,19 +1122,60 @@ def remove_redundant_paths(expand_paths, list_of_path, visited_stations_cost):
     """
 
     not_redundant_list = list_of_path
-    not_redundant_expanded = expand_paths.copy()
     updated_costs = visited_stations_cost.copy()
+    not_redundant_expanded = update_best_costs(expand_paths, updated_costs)
+
+    # A single pass over list_of_path for all the improved stations
+    improved = {expanded.last for expanded in not_redundant_expanded}
+    if improved:
+        not_redundant_list = [p for p in list_of_path if improved.isdisjoint(p.route)]
+
+    return not_redundant_expanded, not_redundant_list, updated_costs
+
+
+def update_best_costs(expand_paths, best_g):
+    """
+      It keeps the expanded paths that reach their last station with a lower g than any previous path
+      and records that g. best_g is UPDATED in place.
+      Format of the parameter is:
+         Args:
+             expand_paths (LIST of Path Class): Expanded paths
+             best_g (dict): Lowest g found so far for every visited station
+         Returns:
+             new_paths (LIST of Path Class): Expanded paths without redundant paths
+    """
+
+    not_redundant_expanded = []
 
     for expanded in expand_paths:
         last = expanded.last
-        if last not in visited_stations_cost or expanded.g < visited_stations_cost[last]:
-            not_redundant_list = [p for p in not_redundant_list if last not in p.route]
-            updated_costs[last] = expanded.g
-        else:
-            not_redundant_expanded.remove(expanded)
+        if last not in best_g or expanded.g < best_g[last]:
+            best_g[last] = expanded.g
+            not_redundant_expanded.append(expanded)
+
+    return not_redundant_expanded
+
+
+def is_redundant(path, best_g):
+    """
+      Lazy counterpart of remove_redundant_paths for the frontier heap: a path that is still in the heap
+      is redundant if a cheaper path has reached any of its stations after it was inserted.
+      The origin stations are never in best_g until some other path reaches them.
+      Format of the parameter is:
+         Args:
+             path (SearchNode): Path popped from the frontier
+             best_g (dict): Lowest g found so far for every visited station
+         Returns:
+             redundant (bool): True if the path is not an optimal solution anymore
+    """
+
+    node = path
+    while node.parent is not None:
+        if best_g[node.last] < node.g:
+            return True
+        node = node.parent
+    return node.last in best_g
 
-    return not_redundant_expanded, not_redundant_list, updated_costs
-                
 
 
 def insert_cost_f(expand_paths, list_of_path):
@@ -388,6 +1198,24 @@ def insert_cost_f(expand_paths, list_of_path):
     return new_paths
 
 
+def insert_cost_f_heap(expand_paths, frontier):
+    """
+        expand_paths is pushed to the frontier heap according to f VALUE.
+        It keeps the same order as insert_cost_f but every insertion is O(log n).
+        Format of the parameter is:
+           Args:
+               expand_paths (LIST of Path Class): Expanded paths
+               frontier (PathHeap): The paths to be visited, ordered by f
+           Returns:
+               frontier (PathHeap): Frontier where expanded_path is inserted according to f
+    """
+
+    for path in expand_paths:
+        path.update_f()
+        frontier.push(path)
+    return frontier
+
+
 def coord2station(coord, map):
     """
         From coordinates, it searches the closest station.
@@ -399,23 +1227,61 @@ def coord2station(coord, map):
             possible_origins (list): List of the Indexes of stations, which corresponds to the closest station
     """
 
-    close_stations = []
-    min_dist = INF
-
-    for id, station in map.stations.items():
-        station_xy = [station["x"], station["y"]]
-        dist = euclidean_dist(station_xy, coord)
-
-        if dist < min_dist:
-            close_stations = [id]
-            min_dist = dist
-        elif dist == min_dist:
-            close_stations.append(id)
+    close_stations, min_dist = map.spatial_index().nearest(coord)
 
+    # Stations further than INF are never considered close
+    if min_dist is None or min_dist > INF:
+        return []
     return close_stations
 
 
-def Astar(origin_coor, dest_coor, map, type_preference=0):
+def coord2station_batch(coords, map, chunk_size=1 << 20):
+    """
+        Vectorized coord2station for many coordinates at once.
+        Format of the parameter is:
+        Args:
+            coords (list or array): N pairs of REAL values, each one a point in the city.
+            map (object of Map class): All the map information
+            chunk_size (int): Maximum number of distances computed at the same time
+        Returns:
+            possible_origins (list): For every coordinate, the list returned by coord2station
+    """
+
+    grid = map.spatial_index()
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    rows = max(1, chunk_size // max(len(grid.ids), 1))
+    snapped = []
+
+    if not grid.ids:
+        return [[] for _ in coords]
+
+    for start in range(0, len(coords), rows):
+        chunk = coords[start:start + rows]
+        chunk_dist = np.sqrt((grid.xs[None, :] - chunk[:, 0:1]) ** 2 + (grid.ys[None, :] - chunk[:, 1:2]) ** 2)
+        min_dist = chunk_dist.min(axis=1, keepdims=True)
+        # The candidates are checked again with the scalar distance, so ties match coord2station exactly
+        rows_ix, positions = np.nonzero(chunk_dist <= min_dist * (1 + 1e-9) + 1e-9)
+        candidates = [[] for _ in chunk]
+        for row, position in zip(rows_ix.tolist(), positions.tolist()):
+            candidates[row].append(position)
+
+        for coord, positions in zip(chunk.tolist(), candidates):
+            close, close_dist = [], math.inf
+            for position in positions:
+                dist = grid.distance(position, coord)
+                if dist < close_dist:
+                    close, close_dist = [position], dist
+                elif dist == close_dist:
+                    close.append(position)
+            # Stations further than INF are never considered close, like in coord2station
+            if close_dist > INF:
+                close = []
+            snapped.append([grid.ids[position] for position in close])
+
+    return snapped
+
+
+def Astar(origin_coor, dest_coor, map, type_preference=0, landmarks=False, stats=None):
     """
      A* Search algorithm
      Format of the parameter is:
@@ -428,26 +1294,94 @@ def Astar(origin_coor, dest_coor, map, type_preference=0):
                             1 - minimum Time
                             2 - minimum Distance
                             3 - minimum Transfers
+            landmarks (bool): Use the landmarks of preprocess_landmarks as well as the usual heuristics
+            stats (SearchStats): If given, it records the work done by the search
         Returns:
             list_of_path[0] (Path Class): The route that goes from origin_id to destination_id
     """  
 
+    if stats is not None:
+        stats.start('Astar')
     # if type(origin_coor) is not list:
     origin_id = coord2station(origin_coor, map)
     destination_id = coord2station(dest_coor, map)
+    if stats is not None:
+        stats.lap('snap')
+    return astar_search(origin_id, destination_id, map, type_preference, landmarks, stats)
+
+
+def astar_search(origin_id, destination_id, map, type_preference=0, landmarks=False, stats=None):
+    """
+     A* Search algorithm between stations that are already snapped (see coord2station)
+     Format of the parameter is:
+        Args:
+            origin_id (list): Starting station ids
+            destination_id (list): Final station ids, the heuristics are computed towards the first one
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected (see Astar)
+            landmarks (bool): Use the landmarks of preprocess_landmarks as well as the usual heuristics
+            stats (SearchStats): If given, it records the work done by the search
+        Returns:
+            list_of_path[0] (Path Class): The route that goes from origin_id to destination_id
+    """
+
+    if stats is not None:
+        stats.start('astar_search')
     visited = dict()
-    paths = [CoolerPath(id) for id in origin_id]
-
-    while paths and paths[0].last not in destination_id:
-        expanded = expand(paths[0], map)
-        expanded = remove_cycles(expanded)
-        paths.pop(0)
-        expanded = calculate_cost(expanded, map, type_preference)
-        expanded, paths, visited = remove_redundant_paths(expanded, paths, visited)
-        expanded = calculate_heuristics(expanded, map, destination_id[0], type_preference)
-        paths = insert_cost_f(expanded, paths)
-
-    if paths:
-        return paths[0]
+    paths = [SearchNode(id) for id in origin_id]
+    # The first origin is expanded before the frontier is ever ordered
+    path = paths[0] if paths else None
+    frontier = PathHeap('f', paths[1:])
+
+    while path is not None and path.last not in destination_id:
+        expanded = expand(path, map)
+        if stats is not None:
+            stats.expansion(expanded)
+        uncycled = remove_cycles(expanded)
+        if stats is not None:
+            stats.pruned_cycles(expanded, uncycled)
+        expanded = calculate_cost(uncycled, map, type_preference)
+        if stats is not None:
+            stats.lap('cost')
+        improving = update_best_costs(expanded, visited)
+        if stats is not None:
+            stats.pruned_redundant(expanded, improving)
+        expanded = calculate_heuristics(improving, map, destination_id[0], type_preference, landmarks)
+        if stats is not None:
+            stats.lap('heuristics')
+        frontier = insert_cost_f_heap(expanded, frontier)
+        if stats is not None:
+            stats.frontier(len(frontier))
+        # Redundant paths are left in the heap and skipped when they are popped
+        path = frontier.pop()
+        while path is not None and is_redundant(path, visited):
+            if stats is not None:
+                stats.redundant_pruned += 1
+            path = frontier.pop()
+
+    if path is not None:
+        return finish_search(stats, path.to_path())
     else:
-        return []
+        return finish_search(stats, [])
+
+
+def cached_astar(origin_coor, dest_coor, map, type_preference=0, landmarks=False):
+    """
+     Astar with the routes kept in map.route_cache by snapped stations, so all the coordinates that snap to the
+     same stations share one search. The cache is emptied when the map changes.
+     Format of the parameter is:
+        Args:
+            origin_coor (list): Two REAL values, starting point
+            dest_coor (list): Two REAL values, final point
+            map (object of Map class): All the map information
+            type_preference: INTEGER Value to indicate the preference selected (see Astar)
+            landmarks (bool): Use the landmarks of preprocess_landmarks as well as the usual heuristics
+        Returns:
+            list_of_path[0] (Path Class): The route that goes from origin_coor to dest_coor
+    """
+
+    origin_id = coord2station(origin_coor, map)
+    destination_id = coord2station(dest_coor, map)
+    key = RouteKey('astar', tuple(origin_id), tuple(destination_id), type_preference, landmarks)
+    return cached_route(map, key,
+                        lambda: astar_search(origin_id, destination_id, map, type_preference, landmarks))
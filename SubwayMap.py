@@ -7,13 +7,31 @@ __group__ = 'TO_BE_FILLED'
 # Universitat Autonoma de Barcelona
 # _________________________________________________________________________________________
 
+import math
+import time
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
+import numpy as np
+
+# Keys of the caches of a Map, so Map.invalidate finds what depends on a type_preference without knowing how the
+# functions of SearchAlgorithm that fill them build their keys
+# map.heuristic_tables, see SearchAlgorithm.heuristic_table
+HeuristicKey = namedtuple('HeuristicKey', 'destination_id type_preference landmarks')
+# map.shortest_path_trees: trees from an origin (SearchAlgorithm.shortest_path_tree) and towards a destination
+# (AlternativeRoutes.distances_to)
+TreeKey = namedtuple('TreeKey', 'origin_id type_preference')
+ReverseTreeKey = namedtuple('ReverseTreeKey', 'destination_id type_preference direction', defaults=('to',))
+# map.route_cache, see SearchAlgorithm.cached_route
+RouteKey = namedtuple('RouteKey', 'search origin_id destination_id type_preference landmarks', defaults=(False,))
+
 
 class Map:
     """
     A class for keeping all the data regarding stations and their connections
 
-    self.stations: is a dictionary of dictionary with the format of
+    self.stations: is a read-only dictionary of dictionary with the format of
             {station_id: {"name": name_value, "line": line_value, ...}
+        backed by the columns of a StationStore, which is what the searches read
 
     self.connectipns: is a dictionary of dictionary holding all the connection information with the format of
             {
@@ -21,26 +39,644 @@ class Map:
                 station_2 : {first_connection_to_station_2: cost_2_1, second_connection_to_station_1: cost_2_2}
                 ....
             }
+
+    The connections are also kept in compressed sparse row (CSR) form, indexed by station id:
+            self.indptr: the edges of station s are the positions self.indptr[s] to self.indptr[s + 1]
+            self.indices: destination station of every edge
+            self.weights: cost of every edge
+    If the map is built with add_csr_connection, the dictionary above is only created when it is accessed.
+
+    The connections can be changed in place (update_connection, remove_connection, restore_connection and
+    update_line_velocity); self.version counts the changes of the map.
     """
 
     def __init__(self):
-        self.stations = {}
-        self.connections = {}
+        self.stations = StationStore()
+        self._connections = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int64)
+        self.weights = np.zeros(0, dtype=np.float64)
+        self._spatial_index = None
+        self._station_arrays = None
+        self._reverse_csr = None
+        self._csr_lists = None
+        # Cost of every connection by type_preference (arrays and lists), see calculate_edge_costs
+        self.edge_cost_tables = {}
+        self.edge_cost_lists = {}
+        self.max_velocity = None
+        # Heuristic tables by HeuristicKey, see SearchAlgorithm.heuristic_table. Each one is a list as long as the
+        # stations, only the heuristic_tables_maxsize most recently used ones are kept.
+        self.heuristic_tables = OrderedDict()
+        self.heuristic_tables_maxsize = 16
+        # Landmark distances by type_preference, see SearchAlgorithm.preprocess_landmarks
+        self.landmarks = {}
+        # Shortest path trees by TreeKey or ReverseTreeKey, see SearchAlgorithm.shortest_path_tree
+        self.shortest_path_trees = OrderedDict()
+        # Routes by RouteKey, see SearchAlgorithm.cached_astar
+        self.route_cache = RouteCache()
+        # Increased every time the stations or the connections change
+        self.version = 0
+        # Connections closed with remove_connection, by (station, connected): (time, position among the edges)
+        self.removed_connections = {}
+        # (method name, arguments) of every incremental change since the connections were last replaced, in
+        # order, and the number of changes made before them; see change_count and BatchRouting.apply_changes
+        self.changes = []
+        self.changes_offset = 0
+        # Shortest path trees are repaired when one connection changes (see ShortestPathTree.update_connection),
+        # instead of being searched again
+        self.repair_trees = True
 
     def add_station(self, id, name, line, x, y):
-        self.stations[id] = {'name': name, 'line': int(line), 'x': x, 'y': y}
+        self.stations.add(id, name, int(line), x, y)
+        self._spatial_index = None
+        self._station_arrays = None
+        # Transfers and distances depend on the stations, they are computed again when they are used
+        self.edge_cost_tables = {}
+        self.edge_cost_lists = {}
+        self.heuristic_tables.clear()
+        self.shortest_path_trees.clear()
+        self.landmarks = {}
+        self.route_cache.clear()
+        self.version += 1
+
+    def station_arrays(self):
+        """
+        Coordinates and lines of the stations as NumPy arrays indexed by station id.
+        Returns (x, y, line); ids without a station have line 0.
+        """
+        if self._station_arrays is None:
+            size = max(self.stations, default=0) + 1
+            x = np.zeros(size, dtype=np.float64)
+            y = np.zeros(size, dtype=np.float64)
+            line = np.zeros(size, dtype=np.int64)
+            columns = len(self.stations.line)
+            x[:columns], y[:columns], line[:columns] = self.stations.x, self.stations.y, self.stations.line
+            self._station_arrays = (x, y, line)
+        return self._station_arrays
+
+    def spatial_index(self):
+        # Built the first time a coordinate is snapped, and again after stations are added
+        if self._spatial_index is None:
+            self._spatial_index = StationGrid(self.stations)
+        return self._spatial_index
+
+    @property
+    def connections(self):
+        if self._connections is None:
+            connections = {}
+            for station in range(len(self.indptr) - 1):
+                start, end = self.indptr[station:station + 2].tolist()
+                if start != end:
+                    connections[station] = dict(zip(self.indices[start:end].tolist(), self.weights[start:end]))
+            self._connections = connections
+        return self._connections
 
     def add_connection(self, connections):
-        self.connections = connections
+        self._connections = connections
+
+        # The edges of every station keep the order of the dictionary
+        size = max([s for s in connections] + [d for c in connections.values() for d in c] + [0]) + 1
+        degree = np.zeros(size, dtype=np.int64)
+        for station, connected in connections.items():
+            degree[station] = len(connected)
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(degree, out=indptr[1:])
+        indices = np.zeros(indptr[-1], dtype=np.int64)
+        weights = np.zeros(indptr[-1], dtype=np.float64)
+        for station, connected in connections.items():
+            start = indptr[station]
+            indices[start:start + len(connected)] = list(connected)
+            weights[start:start + len(connected)] = list(connected.values())
+
+        self.indptr, self.indices, self.weights = indptr, indices, weights
+        self.connections_changed()
+
+    def add_csr_connection(self, indptr, indices, weights):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self._connections = None
+        self.connections_changed()
+
+    def connections_changed(self):
+        # Everything derived from the connections has to be computed again
+        self._reverse_csr = None
+        self._csr_lists = None
+        self.landmarks = {}
+        self.edge_cost_tables = {}
+        self.edge_cost_lists = {}
+        self.heuristic_tables.clear()
+        self.shortest_path_trees.clear()
+        self.route_cache.clear()
+        self.removed_connections = {}
+        # The count of changes keeps growing, so copies of the map can tell which changes they miss
+        self.changes_offset += len(self.changes)
+        self.changes = []
+        self.version += 1
+        self.update_edge_costs()
+
+    def update_edge_costs(self):
+        """
+        Computes the cost of every connection for every type_preference that is not computed yet (minimum
+        distance only once the velocities are known), so the searches read them from self.edge_cost_lists.
+        """
+        for type_preference in (0, 1, 2, 3):
+            if type_preference == 2 and self.max_velocity is None:
+                continue
+            if type_preference not in self.edge_cost_tables:
+                self.edge_cost_tables[type_preference] = self.calculate_edge_costs(type_preference)
+            if type_preference not in self.edge_cost_lists:
+                self.edge_cost_lists[type_preference] = self.edge_cost_tables[type_preference].tolist()
+
+    def calculate_edge_costs(self, type_preference):
+        """
+        Cost of every connection (aligned with self.indices) with the same values SearchAlgorithm.calculate_cost
+        adds to a path that takes it: 0 - Adjacency, 1 - Time, 2 - Distance, 3 - Transfers (1 if both stations
+        have the same name, so this is also the transfer flag of every connection).
+        """
+        sources = np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))
+        destinations = self.indices
+
+        if type_preference == 0:
+            return np.ones(len(destinations), dtype=np.int64)
+        elif type_preference == 1:
+            return self.weights
+
+        stations = self.stations
+        name_ids = np.full(max(len(self.indptr) - 1, len(stations.name_id)), -1, dtype=np.int64)
+        name_ids[:len(stations.name_id)] = stations.name_id
+        transfers = (name_ids[sources] == name_ids[destinations]) & (name_ids[sources] >= 0)
+
+        if type_preference == 2:
+            velocity = np.zeros(len(name_ids), dtype=np.int64)
+            for id in stations:
+                velocity[id] = stations.velocity[id]
+            return np.where(transfers, 0, velocity[destinations]) * self.weights
+        elif type_preference == 3:
+            return transfers.astype(np.int64)
+        return np.zeros(len(destinations), dtype=np.int64)
+
+    def reverse_csr(self):
+        """
+        The connections reversed, in CSR form: for every station, the edges that arrive to it.
+        Returns (indptr, sources, edges), where edges[k] is the position of the k-th reversed edge in self.indices.
+        """
+        if self._reverse_csr is None:
+            edges = np.argsort(self.indices, kind='stable')
+            sources = np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))[edges]
+            size = max(len(self.indptr) - 1, int(self.indices.max(initial=-1)) + 1)
+            indptr = np.zeros(size + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.indices, minlength=size), out=indptr[1:])
+            self._reverse_csr = (indptr, sources, edges)
+        return self._reverse_csr
+
+    def csr_lists(self):
+        """
+        The connections as Python lists (indptr, indices, sources), for searches that read them one at a time.
+        sources[edge] is the station the edge leaves from.
+        """
+        if self._csr_lists is None:
+            sources = np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))
+            self._csr_lists = (self.indptr.tolist(), self.indices.tolist(), sources.tolist())
+        return self._csr_lists
+
+    def edge_index(self, station, connected):
+        """
+        Position in self.indices of the connection from station to connected (None if they are not connected).
+        """
+        if station >= len(self.indptr) - 1:
+            return None
+        start, end = self.indptr[station:station + 2].tolist()
+        found = np.flatnonzero(self.indices[start:end] == connected)
+        return start + int(found[0]) if len(found) else None
+
+    def reverse_neighbours(self, station):
+        """
+        Edges that arrive to station. Returns an iterator of (edge, source_station) pairs, where edge is
+        the position of the connection in self.indices.
+        """
+        indptr, sources, edges = self.reverse_csr()
+        if station >= len(indptr) - 1:
+            return iter(())
+        start, end = indptr[station:station + 2].tolist()
+        return zip(edges[start:end].tolist(), sources[start:end].tolist())
+
+    def add_landmarks(self, type_preference, landmarks, dist_from, dist_to):
+        """
+        Stores the landmarks of a type_preference:
+            landmarks: list of k station ids
+            dist_from: k x N array, dist_from[i][s] is the cost from landmarks[i] to station s
+            dist_to: k x N array, dist_to[i][s] is the cost from station s to landmarks[i]
+        """
+        self.landmarks[type_preference] = (landmarks, dist_from, dist_to)
+        self.heuristic_tables.clear()
+
+    def neighbours(self, station):
+        """
+        Edges that leave station, in the order of the cost table.
+        Returns an iterator of (edge, connected_station) pairs, where edge is the position in self.indices.
+        """
+        if station >= len(self.indptr) - 1:
+            return iter(())
+        start, end = self.indptr[station:station + 2].tolist()
+        return zip(range(start, end), self.indices[start:end].tolist())
 
     def combine_dicts(self):
-        for k, v in self.stations.items():
-            v.update({'velocity': self.velocity[v['line']]})
+        self.stations.set_velocity(self.velocity)
+        self.max_velocity = max([self.stations.velocity[s] for s in self.stations], default=None)
+        # Only the minimum distance costs depend on the velocities
+        self.edge_cost_tables.pop(2, None)
+        self.edge_cost_lists.pop(2, None)
+        self.heuristic_tables.clear()
+        self.shortest_path_trees.clear()
+        self.route_cache.clear()
+        self.version += 1
+        self.update_edge_costs()
 
     def add_velocity(self, velocity):
         self.velocity = {ix+1: v for ix, v in enumerate(velocity)}
         self.combine_dicts()
 
+    def change_count(self):
+        """
+        Number of incremental changes made to the map since it was created; it never decreases.
+        """
+        return self.changes_offset + len(self.changes)
+
+    # Incremental changes of a loaded map. Each one increases self.version, is added to self.changes and only
+    # drops what depends on the type_preferences it changes; the searches give the same routes as a map read
+    # again with the change.
+
+    def update_connection(self, station, connected, cost):
+        """
+        Changes the time of the connection from station to connected, which only changes the time and
+        distance costs.
+        """
+        edge = self.edge_index(station, connected)
+        if edge is None:
+            raise KeyError((station, connected))
+        self.weights[edge] = cost
+        if self._connections is not None:
+            self._connections[station][connected] = cost
+
+        costs = self.connection_costs(station, connected, cost)
+        for type_preference in (1, 2):
+            if type_preference in self.edge_cost_tables:
+                self.edge_cost_tables[type_preference][edge] = costs[type_preference]
+            if type_preference in self.edge_cost_lists:
+                self.edge_cost_lists[type_preference][edge] = costs[type_preference]
+        self.changes.append(('update_connection', (station, connected, cost)))
+        self.invalidate((1, 2), (station, connected))
+
+    def remove_connection(self, station, connected):
+        """
+        Closes the connection from station to connected, until restore_connection. Returns its time.
+        """
+        edge = self.edge_index(station, connected)
+        if edge is None:
+            raise KeyError((station, connected))
+        cost = self.weights[edge].item()
+        if self._connections is not None:
+            cost = self._connections[station].pop(connected)
+        self.removed_connections[(station, connected)] = (cost, edge - int(self.indptr[station]))
+
+        self.indptr[station + 1:] -= 1
+        self.indices = np.delete(self.indices, edge)
+        self.weights = np.delete(self.weights, edge)
+        for type_preference, table in list(self.edge_cost_tables.items()):
+            self.edge_cost_tables[type_preference] = self.weights if type_preference == 1 else np.delete(table, edge)
+        for costs in self.edge_cost_lists.values():
+            del costs[edge]
+        if self._csr_lists is not None:
+            indptr, indices, sources = self._csr_lists
+            for s in range(station + 1, len(indptr)):
+                indptr[s] -= 1
+            del indices[edge], sources[edge]
+        self._reverse_csr = None
+        self.changes.append(('remove_connection', (station, connected)))
+        self.invalidate((0, 1, 2, 3), (station, connected))
+        return cost
+
+    def restore_connection(self, station, connected):
+        """
+        Opens again a connection closed with remove_connection, in the same place among the connections of
+        station and with the time it had.
+        """
+        cost, position = self.removed_connections.pop((station, connected))
+        start, end = self.indptr[station:station + 2].tolist()
+        edge = start + min(position, end - start)
+
+        self.indptr[station + 1:] += 1
+        self.indices = np.insert(self.indices, edge, connected)
+        self.weights = np.insert(self.weights, edge, cost)
+        costs = self.connection_costs(station, connected, cost)
+        for type_preference, table in list(self.edge_cost_tables.items()):
+            self.edge_cost_tables[type_preference] = self.weights if type_preference == 1 else \
+                np.insert(table, edge, costs[type_preference])
+        for type_preference, table in self.edge_cost_lists.items():
+            table.insert(edge, costs[type_preference])
+        if self._csr_lists is not None:
+            indptr, indices, sources = self._csr_lists
+            for s in range(station + 1, len(indptr)):
+                indptr[s] += 1
+            indices.insert(edge, connected)
+            sources.insert(edge, station)
+        if self._connections is not None:
+            # Same order as the edges of station
+            connections = self._connections.get(station, {})
+            self._connections[station] = {c: connections.get(c, cost) for c in self.indices[start:end + 1].tolist()}
+        self._reverse_csr = None
+        self.changes.append(('restore_connection', (station, connected)))
+        self.invalidate((0, 1, 2, 3), (station, connected))
+
+    def update_line_velocity(self, line, velocity):
+        """
+        Changes the velocity of a line, which only changes the distance costs of the connections that arrive
+        to its stations (and the time heuristic if the maximum velocity changes).
+        """
+        self.velocity[line] = velocity
+        self.stations.set_velocity(self.velocity)
+        max_velocity = self.max_velocity
+        self.max_velocity = max([self.stations.velocity[s] for s in self.stations], default=None)
+
+        if 2 in self.edge_cost_tables or 2 in self.edge_cost_lists:
+            _, _, lines = self.station_arrays()
+            transfers = self.edge_cost_tables.get(3)
+            if transfers is None:
+                transfers = self.calculate_edge_costs(3)
+            edges = np.flatnonzero((lines[self.indices] == line) & (transfers == 0))
+            costs = velocity * self.weights[edges]
+            if 2 in self.edge_cost_tables:
+                self.edge_cost_tables[2][edges] = costs
+            if 2 in self.edge_cost_lists:
+                table = self.edge_cost_lists[2]
+                for edge, cost in zip(edges.tolist(), costs.tolist()):
+                    table[edge] = cost
+        self.update_edge_costs()
+        self.changes.append(('update_line_velocity', (line, velocity)))
+        self.invalidate((2,), heuristic_types=(1,) if max_velocity != self.max_velocity else ())
+
+    def connection_costs(self, station, connected, cost):
+        # Cost of one connection for every type_preference, the same values as calculate_edge_costs
+        name_id = self.stations.name_id
+        transfer = int(max(station, connected) < len(name_id) and name_id[station] == name_id[connected] and
+                       name_id[station] >= 0)
+        velocity = self.stations.velocity[connected] if connected in self.stations else 0
+        return {0: 1, 1: float(cost), 2: 0.0 if transfer else float((velocity or 0) * cost), 3: transfer}
+
+    def invalidate(self, type_preferences, connection=None, heuristic_types=()):
+        """
+        Drops the landmarks, shortest path trees, landmark heuristics and cached routes of type_preferences,
+        and all the heuristics of heuristic_types. The other heuristics only depend on the stations.
+        When only connection, a (station, connected) pair, changed, the trees from an origin are repaired.
+        """
+        self.version += 1
+        for type_preference in type_preferences:
+            self.landmarks.pop(type_preference, None)
+        for key in [key for key in self.heuristic_tables if key.type_preference in heuristic_types or
+                    (key.type_preference in type_preferences and key.landmarks)]:
+            del self.heuristic_tables[key]
+        for key in [key for key in self.shortest_path_trees if key.type_preference in type_preferences]:
+            # Trees towards a destination (ReverseTreeKey) keep positions of edges
+            if connection is not None and self.repair_trees and isinstance(key, TreeKey):
+                self.shortest_path_trees[key].update_connection(*connection)
+            else:
+                del self.shortest_path_trees[key]
+        changed = set(type_preferences) | set(heuristic_types)
+        self.route_cache.remove(lambda key: key.type_preference in changed)
+
+
+class StationStore(Mapping):
+    """
+    The stations of a Map kept by column: name_id, line, x, y and velocity are lists indexed by station id.
+    Names are interned, names[name_id[s]] is the name of station s, so two stations have the same name when
+    their name_id is the same. Ids without a station have name_id -1, line 0 and x, y 0.
+
+    It also works as a read-only dictionary, {station_id: {'name': ..., 'line': ..., 'x': ..., 'y': ...}},
+    with 'velocity' once the velocities are set.
+    Usage:
+        >>> map.stations[8]['name'], map.stations.name_id[8]
+    """
+
+    def __init__(self):
+        # Ids in the order they were added
+        self.ids = {}
+        self.names = []
+        self.name_index = {}
+        self.name_id = []
+        self.line = []
+        self.x = []
+        self.y = []
+        self.velocity = []
+
+    def add(self, id, name, line, x, y):
+        if id >= len(self.name_id):
+            missing = id + 1 - len(self.name_id)
+            self.name_id += [-1] * missing
+            self.line += [0] * missing
+            self.x += [0] * missing
+            self.y += [0] * missing
+            self.velocity += [None] * missing
+        if name not in self.name_index:
+            self.name_index[name] = len(self.names)
+            self.names.append(name)
+        self.name_id[id] = self.name_index[name]
+        self.line[id], self.x[id], self.y[id], self.velocity[id] = line, x, y, None
+        self.ids[id] = None
+
+    def set_velocity(self, velocity):
+        # velocity is the velocity of every line
+        for id in self.ids:
+            self.velocity[id] = velocity[self.line[id]]
+
+    def __getitem__(self, id):
+        if id not in self.ids:
+            raise KeyError(id)
+        return StationView(self, id)
+
+    def __contains__(self, id):
+        return id in self.ids
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return repr({id: dict(self[id]) for id in self.ids})
+
+
+class StationView(Mapping):
+    """
+    Read-only dictionary of one station of a StationStore
+    """
+
+    __slots__ = ('store', 'id')
+
+    def __init__(self, store, id):
+        self.store = store
+        self.id = id
+
+    def keys_list(self):
+        if self.store.velocity[self.id] is None:
+            return ['name', 'line', 'x', 'y']
+        return ['name', 'line', 'x', 'y', 'velocity']
+
+    def __getitem__(self, key):
+        if key == 'name':
+            return self.store.names[self.store.name_id[self.id]]
+        if key in ('line', 'x', 'y') or (key == 'velocity' and self.store.velocity[self.id] is not None):
+            return getattr(self.store, key)[self.id]
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.keys_list())
+
+    def __len__(self):
+        return len(self.keys_list())
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class RouteCache:
+    """
+    A bounded cache of routes: the least recently used route is dropped when it is full, and with a ttl
+    (seconds) routes older than ttl are found again. hits and misses count the lookups.
+    Usage:
+        >>> cache = RouteCache(maxsize=1024, ttl=60)
+        >>> cache.put(key, route)
+        >>> cache.get(key)     # None if the key is not cached or has expired
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.routes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.routes)
+
+    def get(self, key):
+        entry = self.routes.get(key)
+        if entry is not None and self.ttl is not None and self.clock() - entry[1] > self.ttl:
+            del self.routes[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.routes.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, route):
+        if self.maxsize <= 0:
+            return
+        self.routes[key] = (route, self.clock())
+        self.routes.move_to_end(key)
+        while len(self.routes) > self.maxsize:
+            self.routes.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.routes.clear()
+
+    def remove(self, condition):
+        # Drops the routes whose key meets condition
+        for key in [key for key in self.routes if condition(key)]:
+            del self.routes[key]
+
+
+class StationGrid:
+    """
+    A uniform grid over the x/y coordinates of the stations, with about one station per cell.
+    nearest() returns the same stations as a linear scan: all the stations at the minimum distance,
+    in the order of map.stations.
+    Usage:
+        >>> grid = StationGrid(map.stations)
+        >>> close_stations, distance = grid.nearest([105, 205])
+    """
+
+    def __init__(self, stations):
+        self.ids = list(stations)
+        self.x = [stations.x[s] for s in self.ids]
+        self.y = [stations.y[s] for s in self.ids]
+        self.xs = np.array(self.x, dtype=np.float64)
+        self.ys = np.array(self.y, dtype=np.float64)
+
+        if not self.ids:
+            self.x0 = self.y0 = 0.0
+            self.size = 1.0
+            self.nx = self.ny = 0
+            self.cells = []
+            return
+
+        self.x0, self.y0 = float(self.xs.min()), float(self.ys.min())
+        width, height = float(self.xs.max()) - self.x0, float(self.ys.max()) - self.y0
+        self.size = max(math.sqrt(width * height / len(self.ids)), width / len(self.ids),
+                        height / len(self.ids), 1.0)
+        self.nx = int(width // self.size) + 1
+        self.ny = int(height // self.size) + 1
+
+        self.cells = [[] for _ in range(self.nx * self.ny)]
+        cx = ((self.xs - self.x0) // self.size).astype(np.int64)
+        cy = ((self.ys - self.y0) // self.size).astype(np.int64)
+        for position, cell in enumerate((cx * self.ny + cy).tolist()):
+            self.cells[cell].append(position)
+
+    def distance(self, position, coord):
+        # Same expression as utils.euclidean_dist(station_xy, coord), so ties are detected the same way
+        return math.sqrt((self.x[position] - coord[0]) ** 2 + (self.y[position] - coord[1]) ** 2)
+
+    def nearest(self, coord):
+        """
+        Returns the ids of the closest stations to coord and their distance (None if there are no stations,
+        inf if a coordinate is not finite).
+        """
+        if not self.ids:
+            return [], None
+        # NaN or infinite coordinates have no cell; no station is close to them, like in the linear scan
+        if not (math.isfinite(coord[0]) and math.isfinite(coord[1])):
+            return [], math.inf
+
+        cx = int(math.floor((coord[0] - self.x0) / self.size))
+        cy = int(math.floor((coord[1] - self.y0) / self.size))
+        # The first ring that touches the grid, and the last one that still has cells in it
+        ring = max(0, cx - self.nx + 1, -cx, cy - self.ny + 1, -cy)
+        last_ring = max(cx, self.nx - 1 - cx, cy, self.ny - 1 - cy)
+
+        close, min_dist = [], math.inf
+        while ring <= last_ring:
+            # Stations out of the rings visited so far are at least (ring - 1) * size away
+            if (ring - 1) * self.size > min_dist * (1 + 1e-9) + 1e-9:
+                break
+            for position in self.ring_positions(cx, cy, ring):
+                dist = self.distance(position, coord)
+                if dist < min_dist:
+                    close, min_dist = [position], dist
+                elif dist == min_dist:
+                    close.append(position)
+            ring += 1
+
+        close.sort()
+        return [self.ids[position] for position in close], min_dist
+
+    def ring_positions(self, cx, cy, ring):
+        x_start, x_end = max(cx - ring, 0), min(cx + ring, self.nx - 1)
+        y_start, y_end = max(cy - ring, 0), min(cy + ring, self.ny - 1)
+        for x in range(x_start, x_end + 1):
+            if ring == 0 or x == cx - ring or x == cx + ring:
+                ys = range(y_start, y_end + 1)
+            else:
+                ys = [y for y in (cy - ring, cy + ring) if y_start <= y <= y_end]
+            for y in ys:
+                yield from self.cells[x * self.ny + y]
+
 
 class Path:
     """
@@ -77,6 +713,9 @@ class Path:
         if other is not None:
             return self.route == other.route
 
+    def __lt__(self, other):
+        return self.route < other.route
+
     def update_h(self, h):
         self.h = h
 
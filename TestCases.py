@@ -1,9 +1,21 @@
 import unittest
 from SearchAlgorithm import *
+from ContractionHierarchy import *
+from AllPairs import *
+from BatchRouting import *
+import BatchRouting
+from AlternativeRoutes import *
+from ParetoRouting import *
+from RoutingServer import *
+from Benchmark import generate_network, run_benchmark, compare_results
 from SubwayMap import *
 from utils import *
 import os
+import copy
+import json
 import random
+import asyncio
+import tempfile
 
 
 class TestCases(unittest.TestCase):
@@ -49,6 +61,27 @@ class TestCases(unittest.TestCase):
         expanded_paths = remove_cycles(expanded_paths)
         self.assertEqual(expanded_paths, [Path([14, 13, 8, 12, 11])])
 
+    def test_csr_connections(self):
+        self.assertEqual([station for _, station in self.map.neighbours(7)], [6, 8])
+        self.assertEqual([self.map.weights[edge] for edge, _ in self.map.neighbours(7)],
+                         [self.map.connections[7][6], self.map.connections[7][8]])
+
+        csr_map = Map()
+        csr_map.add_csr_connection(*read_cost_table_csr(os.path.join(self.ROOT_FOLDER, 'Time.txt')))
+        self.assertEqual(csr_map.connections, self.map.connections)
+        self.assertEqual(list(csr_map.neighbours(12)), list(self.map.neighbours(12)))
+
+    def test_search_node(self):
+        node = SearchNode(14)
+        for station in [13, 8, 12]:
+            node = SearchNode(station, node)
+        self.assertEqual(node.route, [14, 13, 8, 12])
+        self.assertEqual(node.to_path(), Path([14, 13, 8, 12]))
+
+        expanded_paths = remove_cycles(expand(node, self.map))
+        self.assertEqual([path.to_path() for path in expanded_paths], [Path([14, 13, 8, 12, 11])])
+        self.assertTrue(SearchNode(8, node).is_cyclic())
+
     def test_depth_first_search(self):
         route1 = depth_first_search(2, 7, self.map)
         route2 = depth_first_search(13, 1, self.map)
@@ -71,6 +104,17 @@ class TestCases(unittest.TestCase):
         self.assertEqual(route3, Path([5, 10, 11, 12]))
         self.assertEqual(route4, Path([14, 13, 12, 11, 10]))
 
+    def test_search_with_visited(self):
+        route = breadth_first_search(13, 1, self.map, visited=True)
+        self.assertEqual(route, Path([13, 12, 11, 10, 2, 1]))
+
+        route = breadth_first_search(14, 10, self.map, visited=True)
+        self.assertEqual(route, Path([14, 13, 12, 11, 10]))
+
+        route = depth_first_search(14, 10, self.map, visited=True)
+        self.assertEqual((route.head, route.last), (14, 10))
+        self.assertEqual(len(route.route), len(set(route.route)))
+
     def test_calculate_cost(self):
         list_of_path = [Path([7, 6]), Path([7, 8])]
         updated_paths = calculate_cost(
@@ -107,6 +151,60 @@ class TestCases(unittest.TestCase):
         route = uniform_cost_search(9, 3, self.map, 3)
         self.assertEqual(route, Path([9, 8, 7, 6, 5, 2, 3]))
 
+    def test_bidirectional_uniform_cost_search(self):
+        for type_preference in range(4):
+            route = uniform_cost_search(9, 3, self.map, type_preference)
+            bidirectional_route = bidirectional_uniform_cost_search(9, 3, self.map, type_preference)
+            self.assertEqual((bidirectional_route.head, bidirectional_route.last), (9, 3))
+            self.assertAlmostEqual(bidirectional_route.g, route.g)
+
+        self.assertEqual(bidirectional_uniform_cost_search(7, 7, self.map, 1), Path([7]))
+
+    def test_shortest_path_tree(self):
+        tree = shortest_path_tree(9, self.map, 1)
+        self.assertIs(shortest_path_tree(9, self.map, 1), tree)
+
+        route = tree.route(3)
+        self.assertEqual(route, uniform_cost_search(9, 3, self.map, 1))
+        self.assertEqual(route.g, tree.dist[3])
+        self.assertEqual(tree.route(9), Path([9]))
+
+        shortest_path_tree(9, self.map, 1, maxsize=1)
+        shortest_path_tree(3, self.map, 1, maxsize=1)
+        self.assertEqual(list(self.map.shortest_path_trees), [(3, 1)])
+
+    def test_shortest_path_tree_repair(self):
+        tree = shortest_path_tree(9, self.map, 1)
+        station, connected = tree.route(3).route[-2:]
+        cost = self.map.weights[self.map.edge_index(station, connected)]
+
+        def check():
+            # The repaired tree is the one a new search builds
+            self.assertIs(shortest_path_tree(9, self.map, 1), tree)
+            dist, _ = dijkstra(self.map.indptr, self.map.indices, edge_costs(self.map, 1), [9])
+            self.assertEqual(tree.dist.tolist(), dist.tolist())
+            route = uniform_cost_search(9, 3, self.map, 1)
+            self.assertEqual(tree.dist[3], route.g if isinstance(route, Path) else math.inf)
+
+        self.map.update_connection(station, connected, cost * 10)
+        check()
+        self.map.remove_connection(station, connected)
+        check()
+        self.map.restore_connection(station, connected)
+        self.assertEqual(self.map.weights[self.map.edge_index(station, connected)], cost * 10)
+        check()
+        self.map.update_connection(station, connected, cost / 10)
+        check()
+        self.assertEqual(tree.route(3).route[-2:], [station, connected])
+
+    def test_insert_cost_heap(self):
+        expand_paths = [self.create_path_with_g([9, 8, 12], 10), self.create_path_with_g([9, 8, 7], 10)]
+        list_of_path = [self.create_path_with_g([9, 8, 13], 4), self.create_path_with_g([9, 8, 9], 12)]
+        frontier = insert_cost_heap(expand_paths, PathHeap('g', list_of_path))
+        popped = [frontier.pop() for _ in range(len(frontier))]
+        self.assertEqual(popped, insert_cost(expand_paths, list_of_path))
+        self.assertIsNone(frontier.pop())
+
     def test_calculate_heuristics(self):
         expanded_paths = [Path([12, 8, 7]), Path(
             [12, 8, 9]), Path([12, 8, 13])]
@@ -134,6 +232,19 @@ class TestCases(unittest.TestCase):
             expanded_paths, self.map, destination_id=9, type_preference=3)
         self.assertEqual([path.h for path in updated_paths], [0, 0, 1])
 
+    def test_heuristic_table(self):
+        for type_preference in range(4):
+            table = heuristic_table(self.map, 9, type_preference)
+            expanded_paths = calculate_heuristics([Path([12, 8, 7]), Path([12, 8, 13])], self.map,
+                                                  destination_id=9, type_preference=type_preference)
+            self.assertEqual([path.h for path in expanded_paths], [table[7], table[13]])
+            self.assertIs(heuristic_table(self.map, 9, type_preference), table)
+
+        self.map.heuristic_tables_maxsize = 2
+        for destination_id in (3, 9, 14):
+            heuristic_table(self.map, destination_id, 1)
+        self.assertEqual(list(self.map.heuristic_tables), [HeuristicKey(9, 1, False), HeuristicKey(14, 1, False)])
+
     def create_path_with_g(self, r, g):
         path = Path(r)
         path.g = g
@@ -170,6 +281,21 @@ class TestCases(unittest.TestCase):
         self.assertEqual(list_of_path_removed, [path_1, path_2])
         self.assertEqual(new_paths, expand_paths[0:1])
 
+    def test_is_redundant(self):
+        best_g = {}
+        root = SearchNode(12)
+        expanded = calculate_cost(expand(root, self.map), self.map, type_preference=1)
+        expanded = update_best_costs(expanded, best_g)
+        self.assertEqual(sorted(best_g), [8, 11, 13])
+        self.assertFalse(any(is_redundant(path, best_g) for path in expanded))
+
+        # A cheaper path to station 8 makes the old one, and everything below it, redundant
+        path_8 = [path for path in expanded if path.last == 8][0]
+        child = SearchNode(7, path_8)
+        best_g[8] = path_8.g - 1
+        self.assertTrue(is_redundant(path_8, best_g))
+        self.assertTrue(is_redundant(child, best_g))
+
     def test_coord2station(self):
         stationID = coord2station([105, 205], self.map)
         self.assertEqual(stationID, [8, 12, 13])
@@ -180,6 +306,21 @@ class TestCases(unittest.TestCase):
         stationID = coord2station([10, 11], self.map)
         self.assertEqual(stationID, [1])
 
+    def test_coord2station_batch(self):
+        coords = [[105, 205], [300, 111], [10, 11], [82.5, 217.25]]
+        self.assertEqual(coord2station_batch(coords, self.map),
+                         [coord2station(coord, self.map) for coord in coords])
+
+        # Further than INF from every station
+        far = [[1e5, 1e5], [-2e4, 205]]
+        self.assertEqual(coord2station_batch(far, self.map), [[], []])
+        self.assertEqual([coord2station(coord, self.map) for coord in far], [[], []])
+
+        # Not finite: no station is close, like the linear scan
+        nonfinite = [[math.nan, 3], [math.inf, 3], [105, -math.inf], [math.nan, math.nan]]
+        self.assertEqual([coord2station(coord, self.map) for coord in nonfinite], [[], [], [], []])
+        self.assertEqual(coord2station_batch(nonfinite, self.map), [[], [], [], []])
+
     def test_Astar(self):
 
         # If you want to see the optimal_path's route and f-cost,
@@ -216,6 +357,371 @@ class TestCases(unittest.TestCase):
         self.assertEqual(optimal_path, Path([3, 2, 10, 11, 12, 13, 14]))
         self.assertEqual(optimal_path.f, 2)
 
+    def test_Astar_landmarks(self):
+        for type_preference, origin, destination in [(1, [140, 56], [140, 115]), (2, [82, 217], [140, 27])]:
+            landmarks = preprocess_landmarks(self.map, type_preference, k=4)
+            self.assertEqual(len(landmarks), 4)
+
+            optimal_path = Astar(origin, destination, self.map, type_preference)
+            alt_path = Astar(origin, destination, self.map, type_preference, landmarks=True)
+            self.assertAlmostEqual(alt_path.g, optimal_path.g)
+
+            bounds = landmark_bounds(self.map, 3, type_preference)
+            distances, _ = dijkstra(self.map.reverse_csr()[0], self.map.reverse_csr()[1],
+                                    edge_costs(self.map, type_preference)[self.map.reverse_csr()[2]], [3])
+            self.assertTrue(all(bounds[s] <= distances[s] for s in self.map.stations))
+
+    def test_contraction_hierarchy(self):
+        for type_preference in (0, 1, 2):
+            hierarchy = build_contraction_hierarchy(self.map, type_preference)
+            route = uniform_cost_search(9, 3, self.map, type_preference)
+            ch_route = contraction_hierarchy_search(9, 3, hierarchy)
+            self.assertEqual((ch_route.head, ch_route.last), (9, 3))
+            self.assertAlmostEqual(ch_route.g, route.g)
+
+        hierarchy.save('test_hierarchy.npz')
+        try:
+            loaded = ContractionHierarchy.load('test_hierarchy.npz')
+        finally:
+            os.remove('test_hierarchy.npz')
+        self.assertEqual(loaded.query(9, 3), hierarchy.query(9, 3))
+
+    def test_contraction_hierarchy_loops(self):
+        # Transfers cost 0 for the minimum distance, so some best routes go back to a station they visited
+        with tempfile.TemporaryDirectory() as folder:
+            generate_network(folder, 4, 15, 0.3, seed=0)
+            map = read_city(folder)
+        hierarchy = build_contraction_hierarchy(map, 2)
+        for origin_id in map.stations:
+            tree = shortest_path_tree(origin_id, map, 2)
+            for destination_id in map.stations:
+                route = hierarchy.query(origin_id, destination_id)
+                self.assertEqual(len(set(route.route)), len(route.route))
+                self.assertEqual(route.g, tree.dist[destination_id])
+
+    def test_all_pairs_matrix(self):
+        matrix, hops = all_pairs_matrix(self.map, 1, next_hop=True)
+        self.assertAlmostEqual(matrix[9, 3], uniform_cost_search(9, 3, self.map, 1).g, places=4)
+        self.assertEqual(hops[9, 3], 8)
+
+        tree = shortest_path_tree(9, self.map, 1)
+        rows, next_stations = tree_rows([9], self.map.indptr, self.map.indices, edge_costs(self.map, 1), True)
+        self.assertTrue(np.allclose(rows[0], matrix[9]))
+        self.assertTrue(np.allclose(rows[0], tree.dist))
+        self.assertEqual(next_stations[0][3], 8)
+
+    def test_batch_astar(self):
+        pairs = [([108, 206], [67, 79]), ([140, 56], [140, 115]), ([82, 217], [140, 27]), ([105, 205], [67, 79])]
+        for type_preference in range(4):
+            routes = batch_astar(pairs, self.map, type_preference, processes=1, group_size=1)
+            self.assertEqual(routes, [Astar(o, d, self.map, type_preference) for o, d in pairs])
+
+        routes = batch_astar(pairs, self.map, 1, processes=2, city_folder=self.ROOT_FOLDER)
+        self.assertEqual(routes, [Astar(o, d, self.map, 1) for o, d in pairs])
+
+        # Workers that read the city get the changes and the landmarks of the map
+        route = Astar([108, 206], [67, 79], self.map, 1)
+        self.map.update_connection(route.route[0], route.route[1], 1000)
+        preprocess_landmarks(self.map, 1, 4)
+        routes = batch_astar(pairs, self.map, 1, landmarks=True, processes=2, city_folder=self.ROOT_FOLDER)
+        self.assertEqual(routes, [Astar(o, d, self.map, 1, landmarks=True) for o, d in pairs])
+        init_worker(None, self.ROOT_FOLDER, self.map.changes, self.map.landmarks)
+        self.assertEqual(BatchRouting._worker_map.landmarks[1][0], self.map.landmarks[1][0])
+        self.assertEqual(BatchRouting._worker_map.csr_lists(), self.map.csr_lists())
+
+    def test_routing_server(self):
+        async def queries():
+            server = RoutingServer(self.map, processes=1, queue_size=4)
+            await server.start('127.0.0.1', 0)
+            try:
+                # Both queries snap to the same stations, so only one search is run
+                results = await asyncio.gather(server.route([108, 206], [67, 79], 1),
+                                               server.route([108, 206], [67, 79], 1))
+                bad_requests = []
+                for query in ('origin=108&destination=67,79', 'origin=nan,206&destination=67,79',
+                              'origin=108,206&destination=inf,79', 'origin=108,1e400&destination=67,79'):
+                    try:
+                        await server.dispatch('GET', '/route?' + query, b'')
+                    except RequestError as error:
+                        bad_requests.append(error.status)
+                searches = (server.stats['searches'], server.stats['coalesced'])
+
+                # Searches only take the changes the worker does not have yet
+                await server.update('update_connection', results[0]['route'][:2] + [1000])
+                missing = [server.missing_changes()]
+                await server.route([108, 206], [67, 79], 1)
+                missing.append(server.missing_changes())
+            finally:
+                await server.close()
+            return results, bad_requests, searches, missing
+
+        results, bad_requests, searches, missing = asyncio.run(queries())
+        route = Astar([108, 206], [67, 79], read_city(self.ROOT_FOLDER), 1)
+        self.assertEqual(results[0]['route'], route.route)
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(searches, (1, 1))
+        self.assertEqual(bad_requests, [400, 400, 400, 400])
+        self.assertEqual(missing, [(self.map.changes, 0), ([], 1)])
+
+        async def request(data):
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            return await read_request(reader)
+
+        for length in (b'abc', b'-5'):
+            with self.assertRaises(RequestError):
+                asyncio.run(request(b'POST /route HTTP/1.1\r\nContent-Length: ' + length + b'\r\n\r\n'))
+
+    def test_routing_server_update(self):
+        async def queries():
+            server = RoutingServer(self.map, city_folder=self.ROOT_FOLDER, processes=2)
+            await server.start('127.0.0.1', 0)
+            try:
+                before = await server.route([108, 206], [67, 79], 1)
+                body = json.dumps({'method': 'update_connection', 'args': before['route'][:2] + [1000]})
+                update = await server.dispatch('POST', '/update', body.encode())
+                after = await server.route([108, 206], [67, 79], 1)
+                try:
+                    await server.dispatch('POST', '/update', b'{"method": "add_connection", "args": []}')
+                except RequestError as error:
+                    bad_request = error.status
+            finally:
+                await server.close()
+            return before, update, after, bad_request
+
+        before, update, after, bad_request = asyncio.run(queries())
+        self.assertEqual(update['version'], self.map.version)
+        self.assertEqual(after['cost'], Astar([108, 206], [67, 79], self.map, 1).g)
+        self.assertNotEqual(after['cost'], before['cost'])
+        self.assertEqual(bad_request, 400)
+
+        map = read_city(self.ROOT_FOLDER)
+        self.assertEqual(apply_changes(map, self.map.changes), 1)
+        self.assertEqual(map.csr_lists(), self.map.csr_lists())
+        self.assertEqual(edge_cost_list(map, 2), edge_cost_list(self.map, 2))
+
+        # Replacing the connections starts a new log, but the count of changes keeps growing
+        self.map.connections_changed()
+        self.map.update_connection(before['route'][0], before['route'][1], 500)
+        self.assertEqual((self.map.changes_offset, self.map.change_count()), (1, 2))
+        self.assertEqual(apply_changes(map, self.map.changes, self.map.changes_offset), 2)
+        self.assertEqual(map.csr_lists(), self.map.csr_lists())
+        self.assertEqual(edge_cost_list(map, 1), edge_cost_list(self.map, 1))
+        with self.assertRaises(ValueError):
+            apply_changes(read_city(self.ROOT_FOLDER), self.map.changes, self.map.changes_offset)
+
+    def test_route_cache(self):
+        clock = [0]
+        self.map.route_cache = RouteCache(maxsize=2, ttl=10, clock=lambda: clock[0])
+        route = cached_astar([105, 205], [67, 79], self.map, 1)
+        self.assertEqual(route, Astar([105, 205], [67, 79], self.map, 1))
+        self.assertEqual(cached_astar([105, 205], [67, 79], self.map, 1), route)
+        self.assertEqual((self.map.route_cache.hits, self.map.route_cache.misses), (1, 1))
+
+        self.assertEqual(cached_uniform_cost_search(14, 2, self.map, 1), uniform_cost_search(14, 2, self.map, 1))
+        cached_uniform_cost_search(14, 3, self.map, 1)
+        self.assertEqual((len(self.map.route_cache), self.map.route_cache.evictions), (2, 1))
+
+        clock[0] = 11
+        cached_uniform_cost_search(14, 3, self.map, 1)
+        self.assertEqual(self.map.route_cache.misses, 4)
+
+        self.map.add_velocity(read_information(os.path.join(self.ROOT_FOLDER, 'InfoVelocity.txt')))
+        self.assertEqual(len(self.map.route_cache), 0)
+
+    def test_compiled_map(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'city.navmap')
+            write_compiled_map(self.map, filename)
+            map = read_city(filename)
+
+            self.assertEqual(map.stations, self.map.stations)
+            self.assertEqual(map.connections, self.map.connections)
+            self.assertEqual(map.velocity, self.map.velocity)
+            for type_preference in range(4):
+                self.assertEqual(Astar([108, 206], [67, 79], map, type_preference),
+                                 Astar([108, 206], [67, 79], self.map, type_preference))
+
+    def test_sparse_readers(self):
+        filename = os.path.join(self.ROOT_FOLDER, 'Time.txt')
+        connections = read_cost_table(filename)
+        self.assertEqual(read_cost_table_chunked(filename, block_rows=3), connections)
+
+        with tempfile.TemporaryDirectory() as folder:
+            edge_list = os.path.join(folder, 'Edges.txt')
+            with open(edge_list, 'w') as fp:
+                fp.write('# origin, destination, cost\n')
+                for origin, destination, cost in iter_cost_table(filename):
+                    fp.write('{},{},{}\n'.format(origin, destination, float(cost)))
+            self.assertEqual(read_edge_list(edge_list), connections)
+
+            # More empty lines in a row than block_rows do not end the table
+            spaced = os.path.join(folder, 'Time.txt')
+            with open(filename) as source, open(spaced, 'w') as fp:
+                for row in source:
+                    fp.write(row + '\n' * 4)
+            self.assertEqual(read_cost_table_chunked(spaced, block_rows=3), connections)
+
+            # Comment lines are not rows either
+            commented = os.path.join(folder, 'Commented.txt')
+            with open(filename) as source, open(commented, 'w') as fp:
+                for row in source:
+                    fp.write('# row\n' + row)
+            self.assertEqual(read_cost_table(commented), connections)
+            self.assertEqual(read_cost_table_chunked(commented, block_rows=3), connections)
+
+    def test_station_store(self):
+        stations = self.map.stations
+        self.assertEqual(set(stations[8]), {'name', 'line', 'x', 'y', 'velocity'})
+        self.assertEqual(stations.names[stations.name_id[8]], stations[8]['name'])
+        self.assertEqual(stations.velocity[8], self.map.velocity[stations[8]['line']])
+        self.assertEqual(stations.name_id[8] == stations.name_id[12], stations[8]['name'] == stations[12]['name'])
+        self.assertNotIn(0, stations)
+        with self.assertRaises(TypeError):
+            stations[8]['name'] = 'Other'
+
+    def test_edge_cost_lists(self):
+        self.assertEqual(sorted(self.map.edge_cost_lists), [0, 1, 2, 3])
+        stations = self.map.stations
+        for station in stations:
+            for edge, connected in self.map.neighbours(station):
+                self.assertEqual(edge_cost_list(self.map, 3)[edge],
+                                 int(stations[station]['name'] == stations[connected]['name']))
+
+        for type_preference in range(4):
+            nodes = calculate_cost(expand(SearchNode(13, SearchNode(14)), self.map), self.map, type_preference)
+            paths = calculate_cost(expand(CoolerPath([14, 13]), self.map), self.map, type_preference)
+            self.assertEqual([(n.route, n.g, n.transfers) for n in nodes],
+                             [(p.route, p.g, p.transfers) for p in paths])
+
+        # A new station can be a transfer of the existing ones, so everything built from the costs is dropped
+        shortest_path_tree(9, self.map, 3)
+        preprocess_landmarks(self.map, 3, 2)
+        version = self.map.version
+        self.map.add_station(max(stations) + 1, stations[9]['name'], 1, stations[9]['x'], stations[9]['y'])
+        self.assertEqual((self.map.edge_cost_lists, self.map.landmarks), ({}, {}))
+        self.assertEqual(len(self.map.shortest_path_trees), 0)
+        self.assertEqual(self.map.version, version + 1)
+
+    def test_search_stats(self):
+        exported = []
+        stats = SearchStats(callback=lambda s: exported.append(s.as_dict()))
+        route = Astar([108, 206], [67, 79], self.map, 1, stats=stats)
+        self.assertEqual(route, Astar([108, 206], [67, 79], self.map, 1))
+        self.assertEqual(len(exported), 1)
+        self.assertEqual(exported[0]['algorithm'], 'Astar')
+        self.assertGreater(stats.expanded, 0)
+        self.assertIn('snap', stats.times)
+
+        for search in (depth_first_search, breadth_first_search, uniform_cost_search):
+            stats = SearchStats()
+            self.assertEqual(search(14, 2, self.map, stats=stats), search(14, 2, self.map))
+            self.assertEqual((stats.searches, stats.found), (1, 1))
+            self.assertGreaterEqual(stats.generated, stats.cycles_pruned)
+            self.assertGreater(stats.peak_frontier, 0)
+
+    def test_benchmark(self):
+        with tempfile.TemporaryDirectory() as folder:
+            self.assertEqual(generate_network(folder, lines=3, stations_per_line=5, seed=1), 15)
+            map = read_city(folder)
+            self.assertEqual(len(map.stations), 15)
+            self.assertEqual(len(map.velocity), 3)
+            for station in map.stations:
+                for edge, connected in map.neighbours(station):
+                    self.assertEqual(map.connections[connected][station], map.weights[edge])
+
+        results = run_benchmark([(2, 4)], queries=2, algorithms=['uniform_cost_search', 'Astar'], repeat=1)
+        self.assertEqual(sorted(results['networks'][0]['results']),
+                         ['Astar[0]', 'Astar[1]', 'Astar[2]', 'Astar[3]', 'uniform_cost_search[0]',
+                          'uniform_cost_search[1]', 'uniform_cost_search[2]', 'uniform_cost_search[3]'])
+        self.assertEqual(compare_results(results, results), [])
+
+    def test_k_shortest_paths(self):
+        for type_preference in range(4):
+            routes = k_shortest_paths(14, 2, self.map, 3, type_preference)
+            self.assertEqual(len(routes), 3)
+            self.assertEqual(routes[0].g, uniform_cost_search(14, 2, self.map, type_preference).g)
+            self.assertEqual([r.g for r in routes], sorted(r.g for r in routes))
+            self.assertEqual(len({tuple(r.route) for r in routes}), 3)
+            for route in routes:
+                self.assertEqual((route.head, route.last), (14, 2))
+                self.assertEqual(len(set(route.route)), len(route.route))
+                edges = [self.map.edge_index(a, b) for a, b in zip(route.route, route.route[1:])]
+                self.assertEqual(route.g, path_from_edges(14, edges, self.map, type_preference).g)
+
+        self.assertEqual(k_shortest_paths(14, 14, self.map, 3, 1)[0].route, [14])
+
+    def test_pareto_search(self):
+        front = pareto_search(14, 2, self.map)
+        self.assertEqual(front[0].g, uniform_cost_search(14, 2, self.map, 1).g)
+        self.assertEqual(min(r.transfers for r in front), uniform_cost_search(14, 2, self.map, 3).g)
+        self.assertEqual(min(r.distance for r in front), uniform_cost_search(14, 2, self.map, 2).g)
+        for route in front:
+            self.assertEqual((route.head, route.last), (14, 2))
+            self.assertEqual(route.costs, (route.g, route.transfers, route.distance))
+            for other in front:
+                self.assertFalse(other is not route and dominates(other.costs, route.costs))
+
+        self.assertEqual([r.route for r in pareto_search(14, 14, self.map)], [[14]])
+
+    def test_map_updates(self):
+        def read_again(connections):
+            map = read_station_information(os.path.join(self.ROOT_FOLDER, 'Stations.txt'))
+            map.add_connection(copy.deepcopy(connections))
+            map.add_velocity([self.map.velocity[line] for line in sorted(self.map.velocity)])
+            return map
+
+        connections = copy.deepcopy(self.map.connections)
+        best = uniform_cost_search(14, 2, self.map, 1)
+        cached_uniform_cost_search(14, 2, self.map, 3)
+        station, connected = best.route[0], best.route[1]
+        version = self.map.version
+
+        self.map.update_connection(station, connected, 100)
+        connections[station][connected] = 100
+        self.assertEqual(self.map.version, version + 1)
+        self.assertEqual(len(self.map.route_cache), 1)
+        map = read_again(connections)
+        for type_preference in range(4):
+            self.assertEqual(edge_cost_list(self.map, type_preference), edge_cost_list(map, type_preference))
+            self.assertEqual(uniform_cost_search(14, 2, self.map, type_preference),
+                             uniform_cost_search(14, 2, map, type_preference))
+
+        self.map.remove_connection(station, connected)
+        self.map.remove_connection(connected, station)
+        self.assertEqual(len(self.map.route_cache), 0)
+        removed = copy.deepcopy(connections)
+        del removed[station][connected], removed[connected][station]
+        map = read_again(removed)
+        self.assertEqual(self.map.csr_lists(), map.csr_lists())
+        for type_preference in range(4):
+            self.assertEqual(Astar([108, 206], [67, 79], self.map, type_preference),
+                             Astar([108, 206], [67, 79], map, type_preference))
+
+        self.map.restore_connection(connected, station)
+        self.map.restore_connection(station, connected)
+        self.map.update_line_velocity(1, 50)
+        map = read_again(connections)
+        map.update_line_velocity(1, 50)
+        self.assertEqual(self.map.connections, map.connections)
+        self.assertEqual(self.map.max_velocity, map.max_velocity)
+        for type_preference in range(4):
+            self.assertEqual(edge_cost_list(self.map, type_preference), edge_cost_list(map, type_preference))
+            self.assertEqual(uniform_cost_search(14, 2, self.map, type_preference),
+                             uniform_cost_search(14, 2, map, type_preference))
+
+        # Only what depends on the changed type_preferences is dropped, trees from an origin are repaired
+        self.map.shortest_path_trees.clear()
+        self.map.heuristic_tables.clear()
+        for type_preference in (1, 3):
+            shortest_path_tree(14, self.map, type_preference)
+            distances_to(2, self.map, type_preference)
+            heuristic_table(self.map, 2, type_preference)
+        self.map.update_connection(station, connected, 50)
+        self.assertEqual(set(self.map.shortest_path_trees), {TreeKey(14, 1), TreeKey(14, 3), ReverseTreeKey(2, 3)})
+        self.assertEqual(set(self.map.heuristic_tables), {HeuristicKey(2, 1, False), HeuristicKey(2, 3, False)})
+
 
 if __name__ == "__main__":
 
@@ -1,6 +1,9 @@
 from SubwayMap import *
 import numpy as np
 import math
+import os
+import json
+import itertools
 import signal
 import time
 
@@ -48,6 +51,180 @@ def read_cost_table(filename):
     return connections
 
 
+def read_cost_table_csr(filename, block_rows=1024):
+    """
+    Reads the same cost table as read_cost_table, but returns it as CSR arrays for Map.add_csr_connection,
+    indexed by station id like the Map built from read_cost_table. The rows are read block_rows at a time
+    with iter_cost_table, so the memory grows with the number of connections, not with the whole matrix.
+    """
+    origins, destinations, costs = [], [], []
+    for origin, destination, cost in iter_cost_table(filename, block_rows):
+        origins.append(origin)
+        destinations.append(destination)
+        costs.append(cost)
+
+    size = max(max(origins, default=0), max(destinations, default=0)) + 1
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(origins, minlength=size), out=indptr[1:])
+    return indptr, np.array(destinations, dtype=np.int64), np.array(costs, dtype=np.float64)
+
+
+def iter_cost_table(filename, block_rows=1024):
+    """
+    Streams the nonzero entries of a dense cost table (the format of read_cost_table) as (origin, destination,
+    cost), in the same order as read_cost_table, holding at most block_rows rows of the matrix in memory.
+    """
+    with open(filename, 'r') as fp:
+        first_row = 0
+        while True:
+            lines = list(itertools.islice(fp, block_rows))
+            if not lines:
+                break
+            # Empty and comment lines are not rows, like in np.loadtxt; a block of only those is not the end
+            # of the file
+            lines = [line for line in lines if line.split('#', 1)[0].strip()]
+            if not lines:
+                continue
+            block = np.loadtxt(lines, ndmin=2)
+            row, col = block.nonzero()
+            for r, c in zip(row.tolist(), col.tolist()):
+                yield first_row + r + 1, c + 1, block[r][c]
+            first_row += len(block)
+
+
+def iter_edge_list(filename):
+    """
+    Streams a sparse edge list as (origin, destination, cost). Every line has the two station ids and the cost,
+    separated by spaces, tabs or commas; empty lines and lines starting with # are skipped.
+    """
+    with open(filename, 'r') as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            origin, destination, cost = line.replace(',', ' ').split()
+            yield int(origin), int(destination), float(cost)
+
+
+def connections_from_edges(edges):
+    # The connections dictionary of Map.add_connection, in the order of the edges
+    connections = {}
+    for origin, destination, cost in edges:
+        connections.setdefault(origin, {})[destination] = cost
+    return connections
+
+
+def read_cost_table_chunked(filename, block_rows=1024):
+    """
+    The same connections as read_cost_table without loading the whole matrix at once
+    """
+    return connections_from_edges(iter_cost_table(filename, block_rows))
+
+
+def read_edge_list(filename):
+    """
+    Reads a sparse edge list (see iter_edge_list) into the connections of Map.add_connection
+    """
+    return connections_from_edges(iter_edge_list(filename))
+
+
+def read_city(folder):
+    """
+    Builds the Map of a city folder with Stations.txt, Time.txt (or the sparse Edges.txt, see iter_edge_list)
+    and InfoVelocity.txt, or of a file written by write_compiled_map
+    """
+    if os.path.isfile(folder):
+        return read_compiled_map(folder)
+    map = read_station_information(os.path.join(folder, 'Stations.txt'))
+    if os.path.exists(os.path.join(folder, 'Edges.txt')):
+        connections = read_edge_list(os.path.join(folder, 'Edges.txt'))
+    else:
+        connections = read_cost_table_chunked(os.path.join(folder, 'Time.txt'))
+    map.add_connection(connections)
+    infoVelocity_clean = read_information(os.path.join(folder, 'InfoVelocity.txt'))
+    map.add_velocity(infoVelocity_clean)
+    return map
+
+
+# Compiled maps: MAP_MAGIC, the length of a JSON header (uint64) and the header, followed by the arrays
+# described in the header, every one aligned to MAP_ALIGNMENT bytes
+MAP_MAGIC = b'NAVMAP1\0'
+MAP_ALIGNMENT = 64
+
+
+def write_compiled_map(map, filename):
+    """
+    Writes the stations, velocities and CSR connections of a Map in one binary file for read_compiled_map.
+    """
+    ids = list(map.stations)
+    names = [map.stations[s]['name'].encode('utf-8') for s in ids]
+    velocity = getattr(map, 'velocity', {})
+    arrays = {
+        'ids': np.array(ids, dtype=np.int64),
+        'x': np.array([map.stations[s]['x'] for s in ids]),
+        'y': np.array([map.stations[s]['y'] for s in ids]),
+        'line': np.array([map.stations[s]['line'] for s in ids], dtype=np.int64),
+        'name_offsets': np.cumsum([0] + [len(name) for name in names], dtype=np.int64),
+        'names': np.frombuffer(b''.join(names), dtype=np.uint8),
+        'velocity': np.array([velocity[line] for line in sorted(velocity)]),
+        'indptr': map.indptr,
+        'indices': map.indices,
+        'weights': map.weights,
+    }
+
+    layout, offset = {}, 0
+    for key, array in arrays.items():
+        arrays[key] = np.ascontiguousarray(array)
+        layout[key] = {'dtype': arrays[key].dtype.str, 'shape': arrays[key].shape, 'offset': offset}
+        offset += aligned(arrays[key].nbytes)
+    header = json.dumps(layout).encode()
+    start = aligned(len(MAP_MAGIC) + 8 + len(header))
+
+    with open(filename, 'wb') as fp:
+        fp.write(MAP_MAGIC + np.uint64(len(header)).tobytes() + header)
+        for key, array in arrays.items():
+            fp.seek(start + layout[key]['offset'])
+            fp.write(array.tobytes())
+        fp.truncate(start + offset)
+
+
+def aligned(size):
+    return -(-size // MAP_ALIGNMENT) * MAP_ALIGNMENT
+
+
+def read_compiled_map(filename):
+    """
+    Builds a Map from a file written by write_compiled_map. The connections are memory-mapped (copy on write),
+    so nothing is parsed and the pages are only read when they are used.
+    """
+    with open(filename, 'rb') as fp:
+        if fp.read(len(MAP_MAGIC)) != MAP_MAGIC:
+            raise ValueError('{} is not a compiled map'.format(filename))
+        length = int(np.frombuffer(fp.read(8), dtype=np.uint64)[0])
+        header = json.loads(fp.read(length))
+    start = aligned(len(MAP_MAGIC) + 8 + length)
+
+    arrays = {}
+    for key, description in header.items():
+        shape, dtype = tuple(description['shape']), np.dtype(description['dtype'])
+        if int(np.prod(shape)) == 0:
+            arrays[key] = np.zeros(shape, dtype=dtype)
+        else:
+            arrays[key] = np.memmap(filename, dtype=dtype, mode='c', offset=start + description['offset'],
+                                    shape=shape)
+
+    map = Map()
+    names = arrays['names'].tobytes()
+    offsets = arrays['name_offsets'].tolist()
+    for position, (id, line, x, y) in enumerate(zip(arrays['ids'].tolist(), arrays['line'].tolist(),
+                                                    arrays['x'].tolist(), arrays['y'].tolist())):
+        map.add_station(id, names[offsets[position]:offsets[position + 1]].decode('utf-8'), line, x, y)
+    map.add_csr_connection(arrays['indptr'], arrays['indices'], arrays['weights'])
+    if len(arrays['velocity']):
+        map.add_velocity(arrays['velocity'].tolist())
+    return map
+
+
 def print_list_of_path(pathList):
     for p in pathList:
         print("Route: {}".format(p.route))